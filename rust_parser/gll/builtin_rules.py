@@ -15,18 +15,31 @@
 # You should have received a copy of the GNU General Public License
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
-"""Defines the built-in rules of GLL grammars: IDENT, PUNCT, LITERAL, and TOKEN_TREE."""
+"""Defines the built-in rules of GLL grammars: IDENT, PUNCT, LITERAL, and TOKEN_TREE.
+
+The same identifiers, punctuation and literals appear many times in a source
+file, so their from_ast methods are memoized (on the token without its
+surrounding whitespace): equal tokens share the same instance, so these
+classes are frozen."""
 
 from __future__ import annotations
 
 from dataclasses import dataclass
+import functools
 
 from tatsu import grammars
 from tatsu.ast import AST
 
 
-@dataclass
+@functools.lru_cache(maxsize=4096)
+def _make(cls, text: str):
+    """Returns cls(text), memoized."""
+    return cls(text)
+
+
+@dataclass(frozen=True)
 class IDENT:
+    __slots__ = ("ident",)
     ident: str
 
     # from https://doc.rust-lang.org/reference/identifiers.html
@@ -49,11 +62,12 @@ class IDENT:
 
     @classmethod
     def from_ast(cls, ast: str) -> IDENT:
-        return cls(ast.strip())
+        return _make(cls, ast.strip())
 
 
-@dataclass
+@dataclass(frozen=True)
 class LIFETIME:
+    __slots__ = ("lifetime",)
     lifetime: str
 
     RULE = grammars.Rule(
@@ -66,11 +80,12 @@ class LIFETIME:
 
     @classmethod
     def from_ast(cls, ast: str) -> LIFETIME:
-        return cls(ast.strip()[1:].strip())
+        return _make(cls, ast.strip()[1:].strip())
 
 
-@dataclass
+@dataclass(frozen=True)
 class PUNCT:
+    __slots__ = ("punct",)
     punct: str
 
     # from https://github.com/rust-lang/rust/blob/1.46.0/src/librustc_lexer/src/lib.rs#L72-L126
@@ -85,11 +100,12 @@ class PUNCT:
 
     @classmethod
     def from_ast(cls, ast: str) -> PUNCT:
-        return cls(ast.strip())
+        return _make(cls, ast.strip())
 
 
-@dataclass
+@dataclass(frozen=True)
 class LITERAL:
+    __slots__ = ("literal",)
     literal: str
 
     # from https://github.com/rust-lang/rust/blob/1.46.0/src/librustc_lexer/src/lib.rs#L133-L150
@@ -112,11 +128,12 @@ class LITERAL:
 
     @classmethod
     def from_ast(cls, ast: str) -> PUNCT:
-        return cls(ast.strip())
+        return _make(cls, ast.strip())
 
 
 @dataclass
 class TOKEN_TREE:
+    __slots__ = ("tokens",)
     tokens: list
 
     RULE = grammars.Rule(
@@ -17,7 +17,9 @@
 
 """Generates a parser using Tatsu."""
 
+import copy
 from dataclasses import dataclass
+from typing import Optional, Set
 
 from tatsu import grammars as tatsu_grammars
 from tatsu.ast import AST
@@ -118,8 +120,20 @@ def node_to_tatsu(node: gll_grammar.RuleNode):
 
 
 
-def generate_tatsu_grammar(grammar: gll_grammar.Grammar, extra_rules=()) -> tatsu_grammars.Grammar:
-    tatsu_rules = list(extra_rules)
+def generate_tatsu_grammar(
+    grammar: gll_grammar.Grammar,
+    extra_rules=(),
+    memoize_rules: Optional[Set[str]] = None,
+) -> tatsu_grammars.Grammar:
+    """Converts a GLL grammar to a Tatsu grammar.
+
+    Tatsu memoizes the results of all rules by default (except those involved
+    in left recursion); if 'memoize_rules' is given, only these rules are, which
+    avoids the cost of memoization on rules that are seldom tried twice at the
+    same position."""
+    # Copied, as they may be shared with other grammars (eg. BUILTIN_RULES), and
+    # their is_memoizable attribute is set below.
+    tatsu_rules = [copy.copy(rule) for rule in extra_rules]
     for (symbol, rule) in grammar.rules.items():
         tatsu_rule = tatsu_grammars.Rule(
             ast=None,
@@ -130,4 +144,13 @@ def generate_tatsu_grammar(grammar: gll_grammar.Grammar, extra_rules=()) -> tats
         )
         tatsu_rules.append(tatsu_rule)
 
-    return tatsu_grammars.Grammar(name=grammar.name, rules=tatsu_rules)
+    tatsu_grammar = tatsu_grammars.Grammar(name=grammar.name, rules=tatsu_rules)
+
+    if memoize_rules is not None:
+        # Must be done after creating the Grammar, as it sets is_memoizable
+        # on left-recursive rules, which must be kept.
+        for tatsu_rule in tatsu_grammar.rules:
+            if tatsu_rule.name not in memoize_rules:
+                tatsu_rule.is_memoizable = False
+
+    return tatsu_grammar
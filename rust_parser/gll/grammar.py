@@ -21,9 +21,9 @@ But does not generate a parser from this grammar."""
 from __future__ import annotations
 
 import abc
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import enum
-from typing import sealed, Callable, Dict, Iterable, List, Optional, TypeVar
+from typing import sealed, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 from . import tokens
 
@@ -41,6 +41,51 @@ class RuleNode(abc.ABC):
     def visit(self: T, f: TVisitor) -> T:
         return self
 
+    def struct_key(self) -> Tuple:
+        """Returns a hashable value that is equal for structurally equal nodes.
+
+        It is computed lazily and cached on the node, so nodes should not be
+        mutated after this is first called."""
+        try:
+            return self._struct_key
+        except AttributeError:
+            pass
+        # Computed from the leaves up, so the keys of children are already
+        # cached when computing their parent's, and deep trees do not hit
+        # the recursion limit.
+        for node in reversed(list(iter_subtree(self))):
+            if not hasattr(node, "_struct_key"):
+                node._struct_key = (type(node).__name__,) + tuple(
+                    _value_struct_key(getattr(node, field.name))
+                    for field in fields(node)
+                )
+        return self._struct_key
+
+
+def iter_subtree(node: RuleNode) -> Iterator[RuleNode]:
+    """Yields a node and all its descendants, each before its children.
+
+    Iterative, so it works on trees deeper than the recursion limit."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        for field in fields(node):
+            value = getattr(node, field.name)
+            if isinstance(value, RuleNode):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(value)
+
+
+def _value_struct_key(value):
+    if isinstance(value, RuleNode):
+        return value.struct_key()
+    elif isinstance(value, list):
+        return tuple(map(_value_struct_key, value))
+    else:
+        return value
+
 
 @dataclass
 class Empty(RuleNode):
@@ -117,6 +162,13 @@ class Grammar:
     rules: Dict[str, RuleNode]
     name: str = "GeneratedGllGrammar"
 
+    def struct_key(self) -> Tuple:
+        """Returns a hashable value that is equal for structurally equal grammars."""
+        return (
+            self.name,
+            tuple((rule_name, rule.struct_key()) for (rule_name, rule) in self.rules.items()),
+        )
+
 
 _ALTERNATION_TOKEN = object()
 _LABEL_TOKEN = object()
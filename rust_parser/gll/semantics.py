@@ -21,10 +21,18 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 import enum
+import functools
+import hashlib
+import importlib.util
 import keyword
+import os.path
+import stat
+import sys
+import tempfile
 import textwrap
+import types
 import typing
-from typing import Dict, Generic, List, Optional, Type, TypeVar
+from typing import Dict, Generic, List, Optional, Set, Tuple, Type, TypeVar
 
 from tatsu.util import safe_name
 import tatsu.contexts
@@ -36,14 +44,136 @@ from .builtin_rules import BUILTIN_RULES
 _IMPORTS = ["dataclasses", "enum", "typing"]
 """Modules imported by the generated source code."""
 
+_PRELUDE = (
+    "from __future__ import annotations\n\n"
+    + "\n".join(f"import {name}" for name in _IMPORTS)
+    + "\n\nimport rust_parser.gll.semantics\n"
+)
+"""Beginning of the generated source code, which does not depend on the grammar."""
+
+# Templates of the generated code, dedented once and for all, to be filled
+# with str.format.
+# All generated classes have __slots__, as there can be many instances of them
+# (one for each node of a parsed AST), so they should not have a __dict__.
+# They are written explicitly rather than with dataclass(slots=True), which
+# needs Python 3.10; this works as long as fields have no default value.
+
+_EMPTY_TPL = textwrap.dedent(
+    """\
+    class {type_name}(rust_parser.gll.semantics.EmptyLeaf):
+        __slots__ = ()
+    """
+)
+
+_STRLIT_TPL = textwrap.dedent(
+    """\
+    class {type_name}(str):
+        __slots__ = ()
+
+        @classmethod
+        def from_ast(cls, ast: str) -> {type_name}:
+            return cls({ast_accessor})
+    """
+)
+
+_STRLEAF_TPL = textwrap.dedent(
+    """\
+    class {type_name}(rust_parser.gll.semantics.StrLeaf):
+        __slots__ = ()
+    """
+)
+
+_ALIAS_TPL = textwrap.dedent(
+    """\
+    @dataclasses.dataclass
+    class {type_name}:
+        __slots__ = ("inner",)
+        inner: {target_name}
+
+        @classmethod
+        def from_ast(cls, ast) -> {type_name}:
+            return cls(inner={ast_accessor})
+    """
+)
+
+_CONCAT_HEADER_TPL = textwrap.dedent(
+    """\
+    @dataclasses.dataclass
+    class {type_name}:
+        __slots__ = ({slots})
+
+        @classmethod
+        def from_ast(cls, ast) -> {type_name}:
+            return cls({args}
+            )
+    """
+)
+
+# Fields are passed positionally, as it is cheaper than keywords; their order
+# is the order of the fields of the dataclass.
+_CONCAT_ARG_TPL = "\n            {constructor},"
+
+_ALT_HEADER_TPL = textwrap.dedent(
+    """\
+    @typing.sealed
+    class {type_name}(metaclass=rust_parser.gll.semantics.ADT):
+        _variants = {{{variants}}}
+        __slots__ = ()
+    """
+)
+
+# Repeated nodes are tuples rather than lists: they are smaller, and ASTs are not
+# meant to be mutated.
+_REPEATED_TPL = textwrap.dedent(
+    """\
+    class {type_name}(typing.Tuple[{inner_name}, ...]):
+        __slots__ = ()
+
+        @classmethod
+        def from_ast(cls, ast) -> {type_name}:
+            return cls(map({cls}{inner_name}.from_ast, {ast_accessor}{slice_}))
+    """
+)
+
+_REPEATED_TRAILING_TPL = textwrap.dedent(
+    """\
+    class {type_name}(typing.Tuple[{inner_name}, ...]):
+        __slots__ = ()
+
+        @classmethod
+        def from_ast(cls, ast) -> {type_name}:
+            return cls(map({cls}{inner_name}.from_ast, rust_parser.gll.semantics.flatten_repeated_list_with_trailing({separator}, {ast_accessor})))
+    """
+)
+
+USER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "rust_parser"
+)
+"""Directory of the files cached across processes. It must not be writable by
+other users, as code is loaded from it."""
+
+SEMANTICS_CACHE_DIR = os.path.join(USER_CACHE_DIR, "semantics")
+"""Default directory where import_semantics writes generated code."""
+
+_EmitStackItem = typing.Union[
+    Tuple[str, grammar.RuleNode, bool, str, str], typing.Callable[[], None]
+]
+"""Items of the stack used by SemanticsGenerator._emit_type_code: either the
+arguments of a node to process, or an action to run."""
+
+
+_safe_name = functools.lru_cache(maxsize=4096)(safe_name)
+"""Memoized version of tatsu.util.safe_name, which is called for every rule of
+every grammar."""
+
 
 T = TypeVar("T", bound="ADT")
 
 
 def _adt_from_ast(cls: Type[T], ast: typing.Dict[str, typing.Any]) -> T:
-    (variant_name,) = set(ast) & set(cls._variants)
+    (variant_name,) = ast.keys() & cls._variant_names
     value = ast.pop(variant_name)
-    variant_class = getattr(cls, cls._variants[variant_name])
+    variant_class = cls._variant_map[variant_name]
     assert issubclass(variant_class, cls)  # sealed
     if ast:
         # cls is probably a "complex" type, Tatsu wrote
@@ -64,21 +194,60 @@ class ADT(type):
 
         # The class that we are producing
         attributes["from_ast"] = classmethod(_adt_from_ast)
+        attributes["_variant_names"] = frozenset(map(sys.intern, variant_names))
         adt = type(name, parents, attributes)
+        qualname_prefix = f"{adt.__qualname__}."
 
         for (variant_name, variant_type_name) in variant_names.items():
             # get the class defined inside this one.
             variant_source = attributes[variant_type_name]
 
-            variant_parents = list(variant_source.__bases__)
-            if object in variant_parents:
-                variant_parents.remove(object)
+            variant_bases = variant_source.__bases__
+            if variant_bases == (object,):
+                # Most common case (dataclasses)
+                variant_parents = ()
+            else:
+                variant_parents = tuple(
+                    parent for parent in variant_bases if parent is not object
+                )
+            variant_qualname = qualname_prefix + variant_name
+
+            if (
+                object not in variant_bases
+                and variant_source.__qualname__ == qualname_prefix + variant_type_name
+                and not any(
+                    isinstance(attr, types.MethodType)
+                    for attr in variant_source.__dict__.values()
+                )
+            ):
+                # Fast path: the class was defined in the body of this one, so
+                # it is not shared with anything else, and has no bound method
+                # to rebind; so we can simply add the adt to its parents
+                # instead of rebuilding it.
+                # This only works for classes whose parents have the same
+                # layout as the adt (eg. StrLeaf and EmptyLeaf, but not
+                # dataclasses with fields), as CPython does not allow changing
+                # the layout of a class.
+                try:
+                    variant_source.__bases__ = (*variant_parents, adt)
+                except TypeError:
+                    pass
+                else:
+                    variant_source.__qualname__ = variant_qualname
+                    continue
 
             variant_attributes = {
-                "__qualname__": f"{adt.__qualname__}.{variant_name}",
+                "__qualname__": variant_qualname,
             }
+            slots = variant_source.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
             for (attr_name, attr) in variant_source.__dict__.items():
-                if hasattr(attr, "__self__"):
+                if attr_name in slots:
+                    # Member descriptor of a slot; type() creates a new one
+                    # from __slots__, and errors if it's already there.
+                    pass
+                elif isinstance(attr, types.MethodType):
                     # We need to use .__func__ to get the unbound method, or it would be
                     # bound to the old class instead of the new one. (ie. using
                     # 'variant_source.from_ast' directly would return instances of
@@ -96,9 +265,41 @@ class ADT(type):
             # Replace the old one with the one we just created
             setattr(adt, variant_type_name, variant)
 
+        # Plain dict for _adt_from_ast, so it does not need to look up variant
+        # type names then attributes of the class.
+        # Keys are interned, so lookups with interned strings (eg. names
+        # from the generated code) compare by identity.
+        adt._variant_map = {
+            sys.intern(variant_name): getattr(adt, variant_type_name)
+            for (variant_name, variant_type_name) in variant_names.items()
+        }
+
         return adt
 
 
+@dataclass
+class EmptyLeaf:
+    """Base class of the types of empty nodes, so generated semantics do not
+    need a dataclass for each of them."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_ast(cls, ast) -> EmptyLeaf:
+        return cls()
+
+
+class StrLeaf(str):
+    """Base class of the types of string literals, so generated semantics do
+    not need a from_ast method for each of them."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_ast(cls, ast: str) -> StrLeaf:
+        return cls(ast)
+
+
 @typing.sealed
 class Maybe(Generic[T]):
     """An Option like it ought to be: an ADT, not like Python's Optional[T].
@@ -107,6 +308,8 @@ class Maybe(Generic[T]):
     # Ideally this would be named Option/None/Some for consistency with Rust,
     # but it clashes with Python names, so this uses Haskell names instead.
 
+    __slots__ = ()
+
     # FIXME: This leaks memory if the set of types is not bounded. Maybe we can
     # do it with a WeakKeyDictionary?
     __cache = {}
@@ -126,11 +329,16 @@ class Maybe(Generic[T]):
         """Generates Just and Nothing variants for the non-generic class."""
         if type_param in cls.__cache:
             return cls.__cache[type_param]
-        new_cls = type(f"{cls.__qualname__}[{type_param.__qualname__}]", (cls,), {})
+        new_cls = type(
+            f"{cls.__qualname__}[{type_param.__qualname__}]",
+            (cls,),
+            {"__slots__": ()},
+        )
 
         @dataclass
         class Just(new_cls):
             __qualname__ = f"{new_cls.__qualname__}.Just"
+            __slots__ = ("item",)
             item: type_param
 
             @classmethod
@@ -140,7 +348,7 @@ class Maybe(Generic[T]):
         @dataclass
         class Nothing(new_cls):
             __qualname__ = f"{new_cls.__qualname__}.Nothing"
-            pass
+            __slots__ = ()
 
         new_cls.Just = Just
         new_cls.Nothing = Nothing
@@ -206,6 +414,13 @@ class SemanticsGenerator:
         self.used_global_names: Set[str] = set(keyword.kwlist)
         self.generated_global_types: Set[str] = set()
 
+        # node_to_type and node_to_constructor are pure (given
+        # rule_name_to_type_name, which is filled before they are called),
+        # so they can be memoized on the structure of the node.
+        # node_to_type_code can't, as it allocates global names.
+        self._node_type_cache: Dict[tuple, str] = {}
+        self._node_constructor_cache: Dict[Tuple[tuple, str], str] = {}
+
     def gen_global_name(self, name):
         while name in self.used_global_names:
             name += "_"
@@ -219,55 +434,111 @@ class SemanticsGenerator:
 
     def node_to_type(self, node: grammar.RuleNode) -> str:
         """From a rule's description, return a type representing its AST."""
+        # Leaves are the most common nodes, and their type is constant, so
+        # this is cheaper than computing their key to look up the cache.
+        type_ = self._LEAF_TYPES.get(type(node))
+        if type_ is not None:
+            return type_
+        key = node.struct_key()
+        if key in self._node_type_cache:
+            return self._node_type_cache[key]
+        # Compute the types of descendants first (deepest first), so handlers
+        # find the types of children in the cache instead of recursing, and
+        # deep trees do not hit the recursion limit.
+        pending = [node]
+        descendants = []
+        while pending:
+            descendant = pending.pop()
+            descendants.append(descendant)
+            pending.extend(self._type_children(descendant))
+        for descendant in reversed(descendants):
+            if type(descendant) in self._LEAF_TYPES:
+                continue
+            descendant_key = descendant.struct_key()
+            if descendant_key not in self._node_type_cache:
+                self._node_type_cache[descendant_key] = self._node_to_type(descendant)
+        return self._node_type_cache[key]
+
+    def _type_children(self, node: grammar.RuleNode) -> List[grammar.RuleNode]:
+        """Returns the nodes _node_to_type(node) calls node_to_type on."""
         match node:
-            case grammar.Empty():
-                return "None"
-
-            case grammar.LabeledNode(name, item):
-                return self.node_to_type(item)
-
-            case grammar.StringLiteral(string):
-                # TODO: NewType?
-                return "str"
-
-            case grammar.CharacterRange(from_char, to_char):
-                raise NotImplementedError("character ranges")
-
-            case grammar.SymbolName(name):
-                # alias of an other rule
-                return self.rule_name_to_type_name[name]
-
+            case grammar.LabeledNode(_, item) | grammar.Repeated(item=item):
+                return [item]
+            case grammar.Option(item):
+                return [] if type(item) is grammar.Empty else [item]
             case grammar.Concatenation(items):
-                # TODO: use namedtuple if they have names
-                members = tuple(
-                    self.node_to_type(item) for item in items
-                )
-                return f"typing.Tuple[{', '.join(members)}]"
-
+                return items
             case grammar.Alternation(items):
-                # TODO: use an ADT
-                members = tuple(
-                    (
-                        self.node_to_type(item)
-                        if self.node_to_name(item, None)
-                        else "None"
-                    )
-                    for item in items
-                )
-                return f"typing.Union[{', '.join(members)}]"
-
-            case grammar.Option(grammar.Empty()):
-                return "bool"
-
-            case grammar.Option(item):
-                return f"typing.Optional[{self.node_to_type(item)}]"
-
-            case grammar.Repeated(positive, item, separator, allow_trailing):
-                return f"typing.List[{self.node_to_type(item)}]"
-
+                return [item for item in items if self.node_to_name(item, None)]
             case _:
-                # should be unreachable
-                assert False, node
+                return []
+
+    def _node_to_type(self, node: grammar.RuleNode) -> str:
+        handler = self._NODE_TO_TYPE.get(type(node))
+        assert handler is not None, node  # should be unreachable
+        return handler(self, node)
+
+    def _empty_to_type(self, node: grammar.Empty) -> str:
+        return "None"
+
+    def _labeled_node_to_type(self, node: grammar.LabeledNode) -> str:
+        return self.node_to_type(node.item)
+
+    def _string_literal_to_type(self, node: grammar.StringLiteral) -> str:
+        # TODO: NewType?
+        return "str"
+
+    def _character_range_to_type(self, node: grammar.CharacterRange) -> str:
+        raise NotImplementedError("character ranges")
+
+    def _symbol_name_to_type(self, node: grammar.SymbolName) -> str:
+        # alias of an other rule
+        return self.rule_name_to_type_name[node.name]
+
+    def _concatenation_to_type(self, node: grammar.Concatenation) -> str:
+        # TODO: use namedtuple if they have names
+        members = [self.node_to_type(item) for item in node.items]
+        return f"typing.Tuple[{', '.join(members)}]"
+
+    def _alternation_to_type(self, node: grammar.Alternation) -> str:
+        # TODO: use an ADT
+        members = [
+            (
+                self.node_to_type(item)
+                if self.node_to_name(item, None)
+                else "None"
+            )
+            for item in node.items
+        ]
+        return f"typing.Union[{', '.join(members)}]"
+
+    def _option_to_type(self, node: grammar.Option) -> str:
+        if type(node.item) is grammar.Empty:
+            return "bool"
+        return f"typing.Optional[{self.node_to_type(node.item)}]"
+
+    def _repeated_to_type(self, node: grammar.Repeated) -> str:
+        return f"typing.Tuple[{self.node_to_type(node.item)}, ...]"
+
+    _NODE_TO_TYPE = {
+        grammar.Empty: _empty_to_type,
+        grammar.LabeledNode: _labeled_node_to_type,
+        grammar.StringLiteral: _string_literal_to_type,
+        grammar.CharacterRange: _character_range_to_type,
+        grammar.SymbolName: _symbol_name_to_type,
+        grammar.Concatenation: _concatenation_to_type,
+        grammar.Alternation: _alternation_to_type,
+        grammar.Option: _option_to_type,
+        grammar.Repeated: _repeated_to_type,
+    }
+    """Handlers of node_to_type, for each type of node."""
+
+    _LEAF_TYPES = {
+        grammar.Empty: "None",
+        grammar.StringLiteral: "str",
+    }
+    """Return values of node_to_type for nodes whose type does not depend on
+    their content."""
 
     def node_to_name(
         self, node: grammar.RuleNode, default_name: str,
@@ -300,76 +571,134 @@ class SemanticsGenerator:
 
     def node_to_constructor(self, node: grammar.RuleNode, var_name: str) -> str:
         """From a rule's description, return an expression to build it from a Tatsu AST."""
+        key = (node.struct_key(), var_name)
+        if key in self._node_constructor_cache:
+            return self._node_constructor_cache[key]
+        # Same as node_to_type: descendants first, to avoid recursing
+        pending = [(node, var_name)]
+        descendants = []
+        while pending:
+            (descendant, descendant_var_name) = pending.pop()
+            descendants.append((descendant, descendant_var_name))
+            pending.extend(
+                self._constructor_children(descendant, descendant_var_name)
+            )
+        for (descendant, descendant_var_name) in reversed(descendants):
+            descendant_key = (descendant.struct_key(), descendant_var_name)
+            if descendant_key not in self._node_constructor_cache:
+                self._node_constructor_cache[
+                    descendant_key
+                ] = self._node_to_constructor(descendant, descendant_var_name)
+        return self._node_constructor_cache[key]
+
+    def _constructor_children(
+        self, node: grammar.RuleNode, var_name: str
+    ) -> List[Tuple[grammar.RuleNode, str]]:
+        """Returns the arguments _node_to_constructor(node, var_name) calls
+        node_to_constructor with."""
         match node:
-            case grammar.Empty():
-                return "None"
-
             case grammar.LabeledNode(_, item):
-                return self.node_to_constructor(item, var_name)
+                return [(item, var_name)]
+            case grammar.Option(item):
+                return [] if type(item) is grammar.Empty else [(item, var_name)]
+            case grammar.Repeated(item=item):
+                return [(item, _repeated_item_var_name(var_name))]
+            case grammar.Alternation(items):
+                return [
+                    (item, f'ast["{name}"]')
+                    for (name, item) in zip(self._nodes_to_variant_names(items), items)
+                ]
+            case _:
+                return []
 
-            case grammar.StringLiteral(string):
-                # TODO: NewType?
-                return f"str({var_name})"  # we could get rid of the str() call * shrug *
+    def _node_to_constructor(self, node: grammar.RuleNode, var_name: str) -> str:
+        handler = self._NODE_TO_CONSTRUCTOR.get(type(node))
+        assert handler is not None, node  # should be unreachable
+        return handler(self, node, var_name)
 
-            case grammar.CharacterRange(from_char, to_char):
-                raise NotImplementedError("character ranges")
+    def _empty_to_constructor(self, node: grammar.Empty, var_name: str) -> str:
+        return "None"
 
-            case grammar.SymbolName(rule_name):
-                # alias of an other rule
-                return f"{var_name}"
+    def _labeled_node_to_constructor(
+        self, node: grammar.LabeledNode, var_name: str
+    ) -> str:
+        return self.node_to_constructor(node.item, var_name)
 
-            case grammar.Concatenation(items):
-                # TODO: use namedtuple if they have names
-                members = tuple(
-                    self.node_to_type(item) for item in items
-                )
-                return f"tuple(ast.values())"
+    def _string_literal_to_constructor(
+        self, node: grammar.StringLiteral, var_name: str
+    ) -> str:
+        # TODO: NewType?
+        return f"str({var_name})"  # we could get rid of the str() call * shrug *
 
-            case grammar.Alternation(items):
-                variant_names = self._nodes_to_variant_names(items)
-
-                variants = [
-                    (
-                        f"{name}=(lambda: "
-                        + self.node_to_constructor(item, f'ast["{name}"]')
-                        + ")"
-                    )
-                    for (name, item) in zip(variant_names, items)
-                ]
-                # FIXME: that's unreadable, it needs to be refactored
-                return f"(lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict({', '.join(variants)}))()"
+    def _character_range_to_constructor(
+        self, node: grammar.CharacterRange, var_name: str
+    ) -> str:
+        raise NotImplementedError("character ranges")
 
-            case grammar.Option(grammar.Empty()):
-                return f"bool({var_name})"
+    def _symbol_name_to_constructor(
+        self, node: grammar.SymbolName, var_name: str
+    ) -> str:
+        # alias of an other rule
+        return f"{var_name}"
 
-            case grammar.Option(item):
-                return f"{self.node_to_constructor(item, var_name)} if {var_name} else None"
+    def _concatenation_to_constructor(
+        self, node: grammar.Concatenation, var_name: str
+    ) -> str:
+        # TODO: use namedtuple if they have names
+        return f"tuple(ast.values())"
 
-            case grammar.Repeated(positive, item, separator, allow_trailing=False):
-                # FIXME: ugly
-                iter_var_name = var_name.split(".")[-1].replace('["', "_").replace('"]', '') + "_item"
-                if separator:
-                    slice_ = "[0::2]"
-                else:
-                    slice_ = ""
-                return (
-                    f"[{self.node_to_constructor(item, f'{iter_var_name}')} "
-                    f"for {iter_var_name} in {var_name}{slice_}]"
-                )
+    def _alternation_to_constructor(
+        self, node: grammar.Alternation, var_name: str
+    ) -> str:
+        variant_names = self._nodes_to_variant_names(node.items)
 
-            case grammar.Repeated(positive, item, separator, allow_trailing=True):
-                # FIXME: ugly
-                assert separator is not None
-                iter_var_name = var_name.split(".")[-1].replace('["', "_").replace('"]', '') + "_item"
-                return (
-                    f"[{self.node_to_constructor(item, f'{iter_var_name}')} "
-                    f"for {iter_var_name} "
-                    f"in rust_parser.gll.semantics.flatten_repeated_list_with_trailing({repr(separator)}, {var_name})]"
-                )
+        variants = [
+            (
+                f"{name}=(lambda: "
+                + self.node_to_constructor(item, f'ast["{name}"]')
+                + ")"
+            )
+            for (name, item) in zip(variant_names, node.items)
+        ]
+        # FIXME: that's unreadable, it needs to be refactored
+        return f"(lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict({', '.join(variants)}))()"
+
+    def _option_to_constructor(self, node: grammar.Option, var_name: str) -> str:
+        if type(node.item) is grammar.Empty:
+            return f"bool({var_name})"
+        return f"{self.node_to_constructor(node.item, var_name)} if {var_name} else None"
+
+    def _repeated_to_constructor(self, node: grammar.Repeated, var_name: str) -> str:
+        iter_var_name = _repeated_item_var_name(var_name)
+        if node.allow_trailing:
+            assert node.separator is not None
+            return (
+                f"tuple({self.node_to_constructor(node.item, f'{iter_var_name}')} "
+                f"for {iter_var_name} "
+                f"in rust_parser.gll.semantics.flatten_repeated_list_with_trailing({repr(node.separator)}, {var_name}))"
+            )
+        else:
+            if node.separator:
+                slice_ = "[0::2]"
+            else:
+                slice_ = ""
+            return (
+                f"tuple({self.node_to_constructor(node.item, f'{iter_var_name}')} "
+                f"for {iter_var_name} in {var_name}{slice_})"
+            )
 
-            case _:
-                # should be unreachable
-                assert False, node
+    _NODE_TO_CONSTRUCTOR = {
+        grammar.Empty: _empty_to_constructor,
+        grammar.LabeledNode: _labeled_node_to_constructor,
+        grammar.StringLiteral: _string_literal_to_constructor,
+        grammar.CharacterRange: _character_range_to_constructor,
+        grammar.SymbolName: _symbol_name_to_constructor,
+        grammar.Concatenation: _concatenation_to_constructor,
+        grammar.Alternation: _alternation_to_constructor,
+        grammar.Option: _option_to_constructor,
+        grammar.Repeated: _repeated_to_constructor,
+    }
+    """Handlers of node_to_constructor, for each type of node."""
 
     def node_to_type_code(
         self,
@@ -380,267 +709,542 @@ class SemanticsGenerator:
     ) -> str:
         """From a node description, return the source code of a class
         representing its AST."""
+        out: List[str] = []
+        self._emit_type_code(type_name, node, local, ast_accessor, out, "")
+        return "".join(out)
 
-        match node:
-            case grammar.Empty():
-                return textwrap.dedent(
-                    f"""
-                    @dataclasses.dataclass
-                    class {type_name}:
-                        @classmethod
-                        def from_ast(cls, ast):
-                            return cls()
-                    """
-                )
-
-            case grammar.LabeledNode(name, item):
-                # TODO: if the type_name was auto-generated, use the label instead
-                return self.node_to_type_code(type_name, item, local, f'{ast_accessor}["{name}"]')
-
-            case grammar.StringLiteral(string):
-                return textwrap.dedent(
-                    f"""\
-                    class {type_name}(str):
-                        @classmethod
-                        def from_ast(cls, ast: str) -> {type_name}:
-                            return cls({ast_accessor})
-                    """
-                )
-
-            case grammar.CharacterRange(from_char, to_char):
-                raise NotImplementedError("character ranges")
-
-            case grammar.SymbolName(name):
-                # alias of an other rule
-                target_name = self.rule_name_to_type_name[name]
-                # TODO: try to automatically reorder rule definition to
-                # minimize the first case
-
-                return textwrap.dedent(
-                    f"""\
-                    @dataclasses.dataclass
-                    class {type_name}:
-                        inner: {target_name}
-
-                        @classmethod
-                        def from_ast(cls, ast) -> {type_name}:
-                            return cls(inner={ast_accessor})
-                    """
-                )
-
-            case grammar.Concatenation(items):
-                field_names = [
-                    self.gen_local_name(self.node_to_name(item, f"field_{i}"))
-                    for (i, item) in enumerate(items)
-                ]
-                constructors = [
-                    self.node_to_constructor(item, f'{ast_accessor}["{name}"]')
-                    for (name, item) in zip(field_names, items)
-                ]
-                field_types = [
-                    self.node_to_type(item)
-                    for (name, item) in zip(field_names, items)
-                ]
-
-                args = "".join(
-                    f'''
-                                    {name}={constructor},'''
-                    for (name, constructor) in zip(field_names, constructors)
-                )
-
-                lines = [
-                    textwrap.dedent(
-                        f"""\
-                        @dataclasses.dataclass
-                        class {type_name}:
-                            @classmethod
-                            def from_ast(cls, ast) -> {type_name}:
-                                return cls({args}
-                                )
-                        """
-                    )
-                ]
-                lines.extend(
-                    f"    {name}: {type_}"
-                    for (name, type_) in zip(field_names, field_types)
-                )
-                lines.append("")
-                return "\n".join(lines)
-
-            case grammar.Alternation(items) if self._alternation_can_be_enum(items):
-                variant_names = self._nodes_to_variant_names(items)
-                serialized_variant_names = ", ".join(
-                    f'"{name}"' for name in variant_names
-                )
-
-                lines = [
-                    f"@enum.unique",
-                    f"class {type_name}(enum.Enum):",
-                    f"    @staticmethod",
-                    f"    def _variants():",
-                    f"        return frozenset([{serialized_variant_names}])",
-                    f"",
-                    f"    @classmethod",
-                    f"    def from_ast(cls, ast) -> {type_name}:",
-                    f"        (variant,) = set({ast_accessor}) & cls._variants()",
-                    f"        return cls(variant)",
-                    f""
-                ]
-
-                for variant_name in variant_names:
-                    upper_variant_name = self.gen_local_name(variant_name.upper())
-                    lines.append(f'    {upper_variant_name} = "{variant_name}"')
-
-                lines.append("")
-
-                return "\n".join(lines)
+    def _emit_type_code(
+        self,
+        type_name: str,
+        node: grammar.RuleNode,
+        local: bool,
+        ast_accessor: str,
+        out: List[str],
+        indent: str,
+    ) -> None:
+        """Same as node_to_type_code, but appends the lines of the source code
+        to 'out', with 'indent' prepended to each of them."""
+        # Nodes are processed with an explicit stack instead of recursion:
+        # handlers append the code that comes before their children to 'out',
+        # then push on the stack (in reverse order, as it is LIFO) the frames
+        # of their children and actions emitting the code that comes after.
+        stack: List[_EmitStackItem] = [(type_name, node, local, ast_accessor, indent)]
+        while stack:
+            item = stack.pop()
+            if callable(item):
+                item()
+                continue
+            (type_name, node, local, ast_accessor, indent) = item
+            handler = self._NODE_TO_TYPE_CODE.get(type(node))
+            assert handler is not None, node  # should be unreachable
+            handler(self, type_name, node, local, ast_accessor, out, indent, stack)
+
+    def _emit_empty_code(
+        self,
+        type_name,
+        node: grammar.Empty,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        # Always its own class (unlike string literals), as instances of
+        # different empty rules should not be equal.
+        if local:
+            _emit_blank_line(out, local)
+        _emit_code(out, indent, _EMPTY_TPL.format(type_name=type_name))
+
+    def _emit_labeled_node_code(
+        self,
+        type_name,
+        node: grammar.LabeledNode,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        # TODO: if the type_name was auto-generated, use the label instead
+        stack.append(
+            (type_name, node.item, local, f'{ast_accessor}["{node.name}"]', indent)
+        )
+
+    def _emit_string_literal_code(
+        self,
+        type_name,
+        node: grammar.StringLiteral,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        if ast_accessor != "ast":
+            # Labeled, so StrLeaf.from_ast would get the wrong value
+            code = _STRLIT_TPL.format(type_name=type_name, ast_accessor=ast_accessor)
+        else:
+            # Always its own class, so isinstance() and class patterns can
+            # tell different rules apart.
+            code = _STRLEAF_TPL.format(type_name=type_name)
+        _emit_code(out, indent, code)
 
-            case grammar.Alternation(items):
-                blocks = []
-                variant_names = self._nodes_to_variant_names(items)
-                for (name, item) in zip(variant_names, items):
-
-                    # strip the label; we don't want it added to the accessor as
-                    # it's the job of the ADT to unpack it
-                    match item:
-                        case grammar.LabeledNode(name, inner_item):
-                            item = inner_item
-                        case _:
-                            pass
-
-                    block = self.node_to_type_code(
-                        self.gen_local_name(name), item, local=True
-                    )
-                    blocks.append(textwrap.indent(block, "    "))
-
-                blocks.insert(
-                    0,
-                    textwrap.dedent(
-                        f"""\
-                        @typing.sealed
-                        class {type_name}(metaclass=rust_parser.gll.semantics.ADT):
-                            _variants = {{{
-                                ', '.join(
-                                    f'"{variant_name}": "{self.gen_local_name(variant_name)}"'
-                                    for variant_name in variant_names
-                                )
-                            }}}
-                        """
-                    )
+    def _emit_character_range_code(
+        self,
+        type_name,
+        node: grammar.CharacterRange,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        raise NotImplementedError("character ranges")
+
+    def _emit_symbol_name_code(
+        self,
+        type_name,
+        node: grammar.SymbolName,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        # alias of an other rule
+        target_name = self.rule_name_to_type_name[node.name]
+        # TODO: try to automatically reorder rule definition to
+        # minimize the first case
+
+        _emit_code(
+            out,
+            indent,
+            _ALIAS_TPL.format(
+                type_name=type_name,
+                target_name=target_name,
+                ast_accessor=ast_accessor,
+            ),
+        )
+
+    def _emit_concatenation_code(
+        self,
+        type_name,
+        node: grammar.Concatenation,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        fields = self._fields_of_concatenation(node.items, ast_accessor)
+
+        args = "".join(
+            _CONCAT_ARG_TPL.format(constructor=constructor)
+            for (_, _, constructor) in fields
+        )
+
+        slots = ", ".join(f'"{name}"' for (name, _, _) in fields)
+        if len(fields) == 1:
+            slots += ","  # a tuple, not a parenthesized string
+
+        _emit_code(
+            out,
+            indent,
+            _CONCAT_HEADER_TPL.format(type_name=type_name, slots=slots, args=args),
+        )
+        _emit_blank_line(out, local)
+        out.extend(f"{indent}    {name}: {type_}\n" for (name, type_, _) in fields)
+
+    def _fields_of_concatenation(
+        self, items: List[grammar.RuleNode], ast_accessor: str
+    ) -> List[Tuple[str, str, str]]:
+        """Returns the (name, type, constructor) of the field of the class
+        representing each item of a concatenation."""
+        fields = []
+        for (i, item) in enumerate(items):
+            name = self.gen_local_name(self.node_to_name(item, f"field_{i}"))
+            fields.append(
+                (
+                    name,
+                    self.node_to_type(item),
+                    self.node_to_constructor(item, f'{ast_accessor}["{name}"]'),
                 )
+            )
+        return fields
 
-                return "\n".join(blocks).replace("\n\n\n", "\n\n")
-
-            case grammar.Option(item):
-                # TODO: better name
-                if local:
-                    inner_name = self.gen_local_name(f"{type_name}Inner")
-                else:
-                    inner_name = self.gen_global_name(f"{type_name}Inner")
-                blocks = [
-                    self.node_to_type_code(inner_name, item, local),
-                    f"{type_name} = rust_parser.gll.semantics.Maybe[{inner_name}]\n",
-                ]
-                return "\n\n".join(blocks)
-
-            case grammar.Repeated(positive, item, separator, allow_trailing=False):
-                # TODO: better name
-                if local:
-                    inner_name = self.gen_local_name(f"{type_name}Inner")
-                    cls = "cls."
-                else:
-                    inner_name = self.gen_global_name(f"{type_name}Inner")
-                    cls = ""
-                if separator:
-                    slice_ = "[0::2]"
-                else:
-                    slice_ = ""
-                blocks = [
-                    self.node_to_type_code(inner_name, item, local),
-                    textwrap.dedent(
-                        f"""\
-                        class {type_name}(typing.List[{inner_name}]):
-                            @classmethod
-                            def from_ast(cls, ast) -> {type_name}:
-                                return cls(list(map({cls}{inner_name}.from_ast, {ast_accessor}{slice_})))
-                        """
-                    )
-                ]
-                return "\n".join(blocks)
+    def _emit_alternation_code(
+        self,
+        type_name,
+        node: grammar.Alternation,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        if self._alternation_can_be_enum(node.items):
+            self._emit_enum_code(type_name, node, local, ast_accessor, out, indent)
+        else:
+            self._emit_adt_code(type_name, node, local, ast_accessor, out, indent, stack)
+
+    def _emit_enum_code(
+        self, type_name, node: grammar.Alternation, local, ast_accessor, out, indent
+    ) -> None:
+        variant_names = self._nodes_to_variant_names(node.items)
+        serialized_variant_names = ", ".join(
+            f'"{name}"' for name in variant_names
+        )
+
+        lines = [
+            f"@enum.unique",
+            f"class {type_name}(enum.Enum):",
+            f"    @staticmethod",
+            f"    def _variants():",
+            f"        return frozenset([{serialized_variant_names}])",
+            f"",
+            f"    @classmethod",
+            f"    def from_ast(cls, ast) -> {type_name}:",
+            f"        (variant,) = set({ast_accessor}) & cls._variants()",
+            f"        return cls(variant)",
+            f""
+        ]
+
+        for variant_name in variant_names:
+            upper_variant_name = self.gen_local_name(variant_name.upper())
+            lines.append(f'    {upper_variant_name} = "{variant_name}"')
+
+        out.extend(f"{indent}{line}\n" if line else "\n" for line in lines)
+
+    def _emit_adt_code(
+        self,
+        type_name,
+        node: grammar.Alternation,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        variant_names = self._nodes_to_variant_names(node.items)
+        serialized_variants = ", ".join(
+            f'"{variant_name}": "{self.gen_local_name(variant_name)}"'
+            for variant_name in variant_names
+        )
+        _emit_code(
+            out,
+            indent,
+            _ALT_HEADER_TPL.format(
+                type_name=type_name, variants=serialized_variants
+            ),
+        )
+
+        for (name, item) in reversed(list(zip(variant_names, node.items))):
+
+            # strip the label; we don't want it added to the accessor as
+            # it's the job of the ADT to unpack it
+            if type(item) is grammar.LabeledNode:
+                item = item.item
+
+            stack.append(
+                (self.gen_local_name(name), item, True, "ast", indent + "    ")
+            )
+            # Variants are local, so they never have more than one
+            # blank line between two classes.
+            stack.append(functools.partial(_emit_blank_line, out, True))
 
-            case grammar.Repeated(positive, item, separator, allow_trailing=True):
-                # TODO: better name
-                if local:
-                    inner_name = self.gen_local_name(f"{type_name}Inner")
-                    cls = "cls."
-                else:
-                    inner_name = self.gen_global_name(f"{type_name}Inner")
-                    cls = ""
-                assert separator is not None
-                blocks = [
-                    self.node_to_type_code(inner_name, item, local),
-                    textwrap.dedent(
-                        f"""\
-                        class {type_name}(typing.List[{inner_name}]):
-                            @classmethod
-                            def from_ast(cls, ast) -> {type_name}:
-                                return cls(map({cls}{inner_name}.from_ast, rust_parser.gll.semantics.flatten_repeated_list_with_trailing({repr(separator)}, {ast_accessor})))
-                        """
-                    )
-                ]
-                return "\n".join(blocks)
+    def _emit_option_code(
+        self,
+        type_name,
+        node: grammar.Option,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        # TODO: better name
+        if local:
+            inner_name = self.gen_local_name(f"{type_name}Inner")
+        else:
+            inner_name = self.gen_global_name(f"{type_name}Inner")
+        stack.append(
+            functools.partial(
+                _emit_code,
+                out,
+                indent,
+                f"{type_name} = rust_parser.gll.semantics.Maybe[{inner_name}]\n",
+            )
+        )
+        stack.append(functools.partial(_emit_blank_line, out, local))
+        stack.append(functools.partial(_emit_blank_line, out, local))
+        stack.append((inner_name, node.item, local, "ast", indent))
 
-            case _:
-                # should be unreachable
-                assert False, node
+    def _emit_repeated_code(
+        self,
+        type_name,
+        node: grammar.Repeated,
+        local,
+        ast_accessor,
+        out,
+        indent,
+        stack,
+    ) -> None:
+        # TODO: better name
+        if local:
+            inner_name = self.gen_local_name(f"{type_name}Inner")
+            cls = "cls."
+        else:
+            inner_name = self.gen_global_name(f"{type_name}Inner")
+            cls = ""
+        if node.allow_trailing:
+            assert node.separator is not None
+            code = _REPEATED_TRAILING_TPL.format(
+                type_name=type_name,
+                inner_name=inner_name,
+                cls=cls,
+                separator=repr(node.separator),
+                ast_accessor=ast_accessor,
+            )
+        else:
+            if node.separator:
+                slice_ = "[0::2]"
+            else:
+                slice_ = ""
+            code = _REPEATED_TPL.format(
+                type_name=type_name,
+                inner_name=inner_name,
+                cls=cls,
+                ast_accessor=ast_accessor,
+                slice_=slice_,
+            )
+        stack.append(functools.partial(_emit_code, out, indent, code))
+        stack.append(functools.partial(_emit_blank_line, out, local))
+        stack.append((inner_name, node.item, local, "ast", indent))
+
+    _NODE_TO_TYPE_CODE = {
+        grammar.Empty: _emit_empty_code,
+        grammar.LabeledNode: _emit_labeled_node_code,
+        grammar.StringLiteral: _emit_string_literal_code,
+        grammar.CharacterRange: _emit_character_range_code,
+        grammar.SymbolName: _emit_symbol_name_code,
+        grammar.Concatenation: _emit_concatenation_code,
+        grammar.Alternation: _emit_alternation_code,
+        grammar.Option: _emit_option_code,
+        grammar.Repeated: _emit_repeated_code,
+    }
+    """Handlers of node_to_type_code, for each type of node."""
 
     def grammar_to_semantics_code(self, grammar: grammar.Grammar) -> str:
-        lines = []
+        out: List[str] = []
+        self._emit_semantics_code(grammar, out)
+        return "".join(out)
+
+    def _emit_semantics_code(self, grammar: grammar.Grammar, out: List[str]) -> None:
         if self.use_builtin_rules:
-            lines.append("class Semantics(rust_parser.gll.builtin_rules.BuiltinSemantics):")
+            out.append("class Semantics(rust_parser.gll.builtin_rules.BuiltinSemantics):\n")
         else:
-            lines.append("class Semantics:")
-        for rule_name in grammar.rules:
+            out.append("class Semantics:\n")
+        for (i, rule_name) in enumerate(grammar.rules):
             type_name = self.rule_name_to_type_name[rule_name]
-            lines.append(
-                f"    def {safe_name(rule_name)}(self, ast) -> {type_name}:"
+            if i:
+                out.append("\n")
+            out.append(
+                f"    def {type_name}(self, ast) -> {type_name}:\n"
             )
 
-            lines.append(f"        return {type_name}.from_ast(ast)")
-            lines.append("")
-
-        return "\n".join(lines)
+            out.append(f"        return {type_name}.from_ast(ast)\n")
 
     def generate(self, grammar: grammar.Grammar) -> str:
         """entry point of this class"""
         for rule_name in grammar.rules:
             # TODO: escape keywords, special chars, etc.
-            type_name = safe_name(rule_name)
+            type_name = _safe_name(rule_name)
             assert type_name not in self.used_global_names
             self.rule_name_to_type_name[rule_name] = type_name
             self.used_global_names.add(type_name)
 
-        blocks = []
+        out: List[str] = []
         for (rule_name, rule) in grammar.rules.items():
-            code = self.node_to_type_code(rule_name, rule, local=False)
+            self._emit_type_code(rule_name, rule, False, "ast", out, "")
             self.generated_global_types.add(self.rule_name_to_type_name[rule_name])
-            blocks.append(code)
+            out.append("\n\n")
+
+        self._emit_semantics_code(grammar, out)
+
+        return "".join(out)
+
+
+def _repeated_item_var_name(var_name: str) -> str:
+    """Returns the name of the loop variable iterating on 'var_name' in the
+    constructor of a repeated node."""
+    # FIXME: ugly
+    return var_name.split(".")[-1].replace('["', "_").replace('"]', '') + "_item"
+
+
+def _emit_code(out: List[str], indent: str, code: str) -> None:
+    """Appends 'code' to 'out', with 'indent' prepended to non-blank lines.
+    'code' must end with a newline, and have no trailing whitespace."""
+    if indent:
+        # Cheaper than prefixing lines one by one; this also prefixes blank
+        # lines and adds a trailing indent, so they are removed afterward.
+        indented = indent + code.replace("\n", "\n" + indent)
+        out.append(indented[: -len(indent)].replace(indent + "\n", "\n"))
+    else:
+        out.append(code)
 
-        blocks.append(self.grammar_to_semantics_code(grammar))
 
-        return "\n\n".join(blocks)
+def _emit_blank_line(out: List[str], local: bool) -> None:
+    """Appends a blank line to 'out'; unless it is in a local scope (a class body)
+    and the previous line was already blank."""
+    if not (local and out and out[-1] == "\n"):
+        out.append("\n")
 
 
 def generate_semantics_code(grammar: grammar.Grammar, use_builtin_rules=False) -> str:
-    local_imports = ["import rust_parser.gll.semantics\n"]
+    return _generate_semantics_code(_StructuralGrammar(grammar), use_builtin_rules)
+
+
+class _StructuralGrammar:
+    """Wraps a grammar so it is hashed and compared by its structure, to be
+    used as a key of lru_cache (grammars themselves are mutable)."""
+
+    __slots__ = ("grammar", "key")
+
+    def __init__(self, grammar: grammar.Grammar):
+        self.grammar = grammar
+        self.key = grammar.struct_key()
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+@functools.lru_cache(maxsize=32)
+def _generate_semantics_code(
+    structural_grammar: _StructuralGrammar, use_builtin_rules: bool
+) -> str:
+    grammar = structural_grammar.grammar
+    parts = [_PRELUDE]
     if use_builtin_rules:
-        local_imports.append("import rust_parser.gll.builtin_rules\n")
-    blocks = [
-        "from __future__ import annotations",
-        "\n".join(f"import {name}" for name in _IMPORTS),
-        "".join(local_imports),
-        SemanticsGenerator(use_builtin_rules=use_builtin_rules).generate(grammar),
-    ]
+        parts.append("import rust_parser.gll.builtin_rules\n")
+    parts.append("\n\n")
+    parts.append(
+        SemanticsGenerator(use_builtin_rules=use_builtin_rules).generate(grammar)
+    )
+
+    return "".join(parts)
+
+
+def compile_semantics(grammar: grammar.Grammar, use_builtin_rules=False) -> types.CodeType:
+    """Returns a code object of the semantics code generated from the grammar,
+    ready to be passed to exec()."""
+    return _compile_semantics_code(generate_semantics_code(grammar, use_builtin_rules))
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_semantics_code(code: str) -> types.CodeType:
+    return compile(code, f"<semantics:{_code_digest(code)}>", "exec")
+
+
+def import_semantics(
+    grammar: grammar.Grammar,
+    use_builtin_rules=False,
+    cache_dir: Optional[str] = None,
+) -> types.ModuleType:
+    """Returns a module of the semantics code generated from the grammar.
+
+    The code is written to a file in 'cache_dir' (which defaults to
+    SEMANTICS_CACHE_DIR), named after its digest, so it is only written once
+    and CPython can reuse its bytecode in other processes.
+    If 'cache_dir' can't be written, or could be written by other users, the
+    code is run without being cached."""
+    return import_semantics_code(
+        generate_semantics_code(grammar, use_builtin_rules), cache_dir
+    )
+
+
+def import_semantics_code(
+    code: str, cache_dir: Optional[str] = None
+) -> types.ModuleType:
+    """Same as import_semantics, but takes code returned by
+    generate_semantics_code instead of a grammar."""
+    digest = _code_digest(code)
+    module_fullname = f"rust_parser.asts.sem_{digest}"
+    if module_fullname in sys.modules:
+        return sys.modules[module_fullname]
+
+    if cache_dir is None:
+        cache_dir = SEMANTICS_CACHE_DIR
+    filename = _write_cached_code(code, digest, cache_dir)
+    if filename is None:
+        # The cache can't be used, run the code without writing it to a file
+        module = types.ModuleType(module_fullname)
+        run = functools.partial(exec, _compile_semantics_code(code), module.__dict__)
+    else:
+        spec = importlib.util.spec_from_file_location(module_fullname, filename)
+        module = importlib.util.module_from_spec(spec)
+        run = functools.partial(spec.loader.exec_module, module)
+
+    sys.modules[module_fullname] = module  # needed by dataclasses when executing
+    try:
+        run()
+    except BaseException:
+        del sys.modules[module_fullname]
+        raise
+    return module
+
+
+def _write_cached_code(code: str, digest: str, cache_dir: str) -> Optional[str]:
+    """Returns the name of a file of 'cache_dir' containing 'code', after
+    writing it if needed; or None if 'cache_dir' can't be used."""
+    filename = os.path.join(cache_dir, f"sem_{digest}.py")
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not is_private_dir(cache_dir):
+            # Other users could have written the file
+            return None
+        if not os.path.exists(filename):
+            write_file_atomically(filename, code.encode())
+    except OSError:
+        return None
+    return filename
+
+
+def is_private_dir(path: str) -> bool:
+    """Returns whether 'path' is a directory owned by the current user, and
+    not writable by other users, so files loaded from it can be trusted."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+    )
+
+
+def write_file_atomically(filename: str, data: bytes) -> None:
+    """Writes 'data' to a temporary file, then renames it to 'filename', so
+    other processes never read a partial file.
+
+    Raises OSError on failure, after removing the temporary file."""
+    (fd, tmp_filename) = tempfile.mkstemp(
+        suffix=".tmp", dir=os.path.dirname(filename)
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        raise
 
 
-    return "\n\n".join(blocks)
+def _code_digest(code: str) -> str:
+    return hashlib.blake2b(code.encode(), digest_size=16).hexdigest()
@@ -15,8 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
+import dataclasses
 import re
 
+import pytest
 from tatsu.grammars import Grammar
 
 from ..builtin_rules import (
@@ -44,6 +46,11 @@ def test_ident():
     assert parse("foo_bar") == TOKEN_TREE(IDENT("foo_bar"))
     assert parse("_42") == TOKEN_TREE(IDENT("_42"))
 
+    assert IDENT.from_ast("foo") is IDENT.from_ast("foo")
+    assert IDENT.from_ast(" foo") is IDENT.from_ast("foo")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        IDENT.from_ast("foo").ident = "bar"
+
 
 def test_lifetime():
     assert parse("'foo") == TOKEN_TREE(LIFETIME("foo"))
@@ -21,6 +21,7 @@ from tatsu import grammars as tatsu_grammars
 from tatsu import exceptions
 
 from .. import grammar as gll_grammar
+from ..builtin_rules import BUILTIN_RULES
 from ..generate import generate_tatsu_grammar
 
 
@@ -330,3 +331,51 @@ def test_repeat_positive_separator_trailing():
         assert g.parse("") == []
     with pytest.raises(exceptions.FailedParse):
         assert g.parse("baz") == []
+
+
+def test_memoize_rules():
+    grammar = gll_grammar.Grammar(
+        rules={
+            "Main": gll_grammar.Alternation(
+                [
+                    gll_grammar.Concatenation(
+                        [
+                            gll_grammar.SymbolName("Main"),
+                            gll_grammar.StringLiteral("+"),
+                            gll_grammar.SymbolName("Atom"),
+                        ]
+                    ),
+                    gll_grammar.SymbolName("Atom"),
+                ]
+            ),
+            "Atom": gll_grammar.Alternation(
+                [gll_grammar.SymbolName("Foo"), gll_grammar.StringLiteral("bar")]
+            ),
+            "Foo": gll_grammar.StringLiteral("foo"),
+        }
+    )
+
+    g = generate_tatsu_grammar(grammar)
+    memoizable = {rule.name: rule.is_memoizable for rule in g.rules}
+    # Tatsu does not memoize left-recursive rules
+    assert memoizable == {"Main": False, "Atom": True, "Foo": True}
+
+    g = generate_tatsu_grammar(grammar, memoize_rules={"Main", "Foo"})
+    memoizable = {rule.name: rule.is_memoizable for rule in g.rules}
+    assert memoizable == {"Main": False, "Atom": False, "Foo": True}
+
+    assert g.parse("foo + bar + foo") == (("foo", "+", "bar"), "+", "foo")
+
+
+def test_memoize_rules_extra_rules():
+    grammar = gll_grammar.Grammar(rules={"Main": gll_grammar.SymbolName("IDENT")})
+    memoizable = [rule.is_memoizable for rule in BUILTIN_RULES]
+
+    g = generate_tatsu_grammar(
+        grammar, extra_rules=BUILTIN_RULES, memoize_rules={"Main"}
+    )
+    memoized_rules = {rule.name for rule in g.rules if rule.is_memoizable}
+    assert memoized_rules == {"Main"}
+
+    # Not changed by the previous call
+    assert [rule.is_memoizable for rule in BUILTIN_RULES] == memoizable
@@ -505,3 +505,21 @@ def test_label_repeated():
             )
         }
     )
+
+
+def test_struct_key():
+    assert (
+        Concatenation([StringLiteral("foo"), Option(StringLiteral("bar"))]).struct_key()
+        == Concatenation([StringLiteral("foo"), Option(StringLiteral("bar"))]).struct_key()
+    )
+    assert (
+        Concatenation([StringLiteral("foo"), Option(StringLiteral("bar"))]).struct_key()
+        != Alternation([StringLiteral("foo"), Option(StringLiteral("bar"))]).struct_key()
+    )
+    assert (
+        Repeated(False, StringLiteral("foo"), "bar", False).struct_key()
+        != Repeated(False, StringLiteral("foo"), "bar", True).struct_key()
+    )
+    assert Grammar(rules={"Value": StringLiteral("foo")}).struct_key() != Grammar(
+        rules={"Other": StringLiteral("foo")}
+    ).struct_key()
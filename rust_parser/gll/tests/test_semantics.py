@@ -16,6 +16,7 @@
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
 import dataclasses
+import sys
 import textwrap
 
 import pytest
@@ -23,7 +24,14 @@ import tatsu
 from tatsu import exceptions
 
 from .. import grammar as gll_grammar
-from ..semantics import ADT, generate_semantics_code, Maybe
+from ..semantics import (
+    ADT,
+    compile_semantics,
+    generate_semantics_code,
+    import_semantics,
+    Maybe,
+    StrLeaf,
+)
 from ..generate import generate_tatsu_grammar
 from ..builtin_rules import BUILTIN_RULES, IDENT
 
@@ -34,6 +42,7 @@ def test_qualname_maybe():
     assert Main.__qualname__ == "Maybe[str]"
     assert Main.Just.__qualname__ == "Maybe[str].Just"
     assert Main.Nothing.__qualname__ == "Maybe[str].Nothing"
+    assert not hasattr(Main.Nothing(), "__dict__")
 
 
 def test_qualname_adt():
@@ -58,6 +67,101 @@ def test_qualname_adt():
     assert Main.Baz.__qualname__ == f"Maybe[str]"
 
 
+def test_adt_builtin_variant():
+    body_classes = {}
+
+    class Main(metaclass=ADT):
+        _variants = {"Foo": "Foo", "Bar": "Bar"}
+
+        class Foo(str):
+            @classmethod
+            def from_ast(cls, ast):
+                return cls(ast)
+
+        @dataclasses.dataclass
+        class Bar:
+            pass
+
+        body_classes.update(Foo=Foo, Bar=Bar)
+
+    # Subclasses of builtin types are reused, other classes are rebuilt
+    assert Main.Foo is body_classes["Foo"]
+    assert Main.Bar is not body_classes["Bar"]
+    assert Main._variant_map == {"Foo": Main.Foo, "Bar": Main.Bar}
+
+    prefix = "test_adt_builtin_variant.<locals>."
+    assert Main.Foo.__qualname__ == f"{prefix}Main.Foo"
+    assert issubclass(Main.Foo, Main)
+    assert issubclass(Main.Foo, str)
+    assert Main.Foo.from_ast("foo") == "foo"
+    assert isinstance(Main.Foo.from_ast("foo"), Main)
+    assert isinstance(Main.from_ast({"Foo": "foo"}), Main.Foo)
+
+
+def test_compile_semantics_cache():
+    def make_grammar():
+        return gll_grammar.Grammar(rules={"Foo": gll_grammar.StringLiteral("foo")})
+
+    assert generate_semantics_code(make_grammar()) is generate_semantics_code(
+        make_grammar()
+    )
+
+    code = compile_semantics(make_grammar())
+    assert compile_semantics(make_grammar()) is code
+    assert compile_semantics(make_grammar(), use_builtin_rules=True) is not code
+
+
+def test_import_semantics(tmp_path):
+    grammar = gll_grammar.Grammar(
+        rules={
+            "Main": gll_grammar.Concatenation(
+                [gll_grammar.LabeledNode("foo", gll_grammar.StringLiteral("foo"))]
+            )
+        }
+    )
+
+    module = import_semantics(grammar, cache_dir=str(tmp_path))
+    assert module.Main.from_ast({"foo": "foo"}) == module.Main("foo")
+    assert import_semantics(grammar, cache_dir=str(tmp_path)) is module
+    assert [str(path) for path in tmp_path.glob("*.py")] == [module.__file__]
+
+
+@pytest.mark.parametrize("setup", ["missing_parent", "writable_by_others"])
+def test_import_semantics_unusable_cache(tmp_path, setup):
+    if setup == "missing_parent":
+        (tmp_path / "file").write_text("")
+        cache_dir = tmp_path / "file" / "cache"
+    else:
+        cache_dir = tmp_path / "cache"
+        cache_dir.mkdir()
+        cache_dir.chmod(0o777)
+    grammar = gll_grammar.Grammar(
+        rules={f"Main_{setup}": gll_grammar.StringLiteral("foo")}
+    )
+
+    module = import_semantics(grammar, cache_dir=str(cache_dir))
+    assert getattr(module, f"Main_{setup}").from_ast("foo") == "foo"
+    assert not list(tmp_path.glob("**/*.py"))
+
+
+def test_deeply_nested_labels():
+    node = gll_grammar.StringLiteral("foo")
+    for _ in range(sys.getrecursionlimit() * 2):
+        node = gll_grammar.LabeledNode("foo", node)
+
+    grammar = gll_grammar.Grammar(
+        rules={
+            "Main": node,
+            # node_to_type and node_to_constructor of the field
+            "Pair": gll_grammar.Concatenation([node, gll_grammar.SymbolName("Main")]),
+        }
+    )
+    code = generate_semantics_code(grammar)
+
+    assert "\nclass Main(str):\n" in code
+    assert "\n    foo: str\n" in code
+
+
 def test_simple_grammar():
     grammar = gll_grammar.Grammar(rules={"Foo": gll_grammar.StringLiteral("foo")})
     sc = generate_semantics_code(grammar)
@@ -74,10 +178,8 @@ def test_simple_grammar():
         import rust_parser.gll.semantics
 
 
-        class Foo(str):
-            @classmethod
-            def from_ast(cls, ast: str) -> Foo:
-                return cls(ast)
+        class Foo(rust_parser.gll.semantics.StrLeaf):
+            __slots__ = ()
 
 
         class Semantics:
@@ -87,14 +189,57 @@ def test_simple_grammar():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
+    # Not shared with other rules
+    assert namespace["Foo"] is not StrLeaf
 
     assert g.parse("foo", semantics=semantics) == "foo"
     with pytest.raises(exceptions.FailedToken):
         g.parse("bar", semantics=semantics)
 
 
+def test_empty_rules():
+    grammar = gll_grammar.Grammar(
+        rules={"Unsafety": gll_grammar.Empty(), "Constness": gll_grammar.Empty()}
+    )
+    sc = generate_semantics_code(grammar)
+
+    assert sc == textwrap.dedent(
+        """\
+        from __future__ import annotations
+
+        import dataclasses
+        import enum
+        import typing
+
+        import rust_parser.gll.semantics
+
+
+        class Unsafety(rust_parser.gll.semantics.EmptyLeaf):
+            __slots__ = ()
+
+
+        class Constness(rust_parser.gll.semantics.EmptyLeaf):
+            __slots__ = ()
+
+
+        class Semantics:
+            def Unsafety(self, ast) -> Unsafety:
+                return Unsafety.from_ast(ast)
+
+            def Constness(self, ast) -> Constness:
+                return Constness.from_ast(ast)
+    """
+    )
+
+    namespace = {}
+    exec(compile_semantics(grammar), namespace)
+
+    assert namespace["Unsafety"].from_ast(None) == namespace["Unsafety"]()
+    assert namespace["Unsafety"]() != namespace["Constness"]()
+
+
 def test_labeled_concatenation():
     grammar = gll_grammar.Grammar(
         rules={
@@ -138,12 +283,14 @@ def test_labeled_concatenation():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field", "baz_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=str(ast["bar_field"]) if ast["bar_field"] else None,
-                    baz_field=bool(ast["baz_field"]),
+                    str(ast["foo_field"]),
+                    str(ast["bar_field"]) if ast["bar_field"] else None,
+                    bool(ast["baz_field"]),
                 )
 
             foo_field: str
@@ -158,7 +305,7 @@ def test_labeled_concatenation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -199,21 +346,16 @@ def test_labeled_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar", "Baz": "Baz"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
-            class Bar(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Bar:
-                    return cls(ast)
+            class Bar(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
-            class Baz(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Baz:
-                    return cls(ast)
+            class Baz(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
 
         class Semantics:
@@ -223,7 +365,7 @@ def test_labeled_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -304,14 +446,17 @@ def test_labeled_alternation_labeled_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar", "Baz": "Baz"}
+            __slots__ = ()
 
             @dataclasses.dataclass
             class Foo:
+                __slots__ = ("foo1", "foo2")
+
                 @classmethod
                 def from_ast(cls, ast) -> Foo:
                     return cls(
-                        foo1=str(ast["foo1"]),
-                        foo2=str(ast["foo2"]),
+                        str(ast["foo1"]),
+                        str(ast["foo2"]),
                     )
 
                 foo1: str
@@ -319,11 +464,13 @@ def test_labeled_alternation_labeled_alternation():
 
             @dataclasses.dataclass
             class Bar:
+                __slots__ = ("bar1", "bar2")
+
                 @classmethod
                 def from_ast(cls, ast) -> Bar:
                     return cls(
-                        bar1=str(ast["bar1"]),
-                        bar2=str(ast["bar2"]),
+                        str(ast["bar1"]),
+                        str(ast["bar2"]),
                     )
 
                 bar1: str
@@ -331,11 +478,13 @@ def test_labeled_alternation_labeled_alternation():
 
             @dataclasses.dataclass
             class Baz:
+                __slots__ = ("baz1", "baz2")
+
                 @classmethod
                 def from_ast(cls, ast) -> Baz:
                     return cls(
-                        baz1=str(ast["baz1"]),
-                        baz2=str(ast["baz2"]),
+                        str(ast["baz1"]),
+                        str(ast["baz2"]),
                     )
 
                 baz1: str
@@ -349,7 +498,7 @@ def test_labeled_alternation_labeled_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -383,10 +532,8 @@ def test_option():
         import rust_parser.gll.semantics
 
 
-        class MainInner(str):
-            @classmethod
-            def from_ast(cls, ast: str) -> MainInner:
-                return cls(ast)
+        class MainInner(rust_parser.gll.semantics.StrLeaf):
+            __slots__ = ()
 
 
         Main = rust_parser.gll.semantics.Maybe[MainInner]
@@ -399,7 +546,7 @@ def test_option():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -444,12 +591,14 @@ def test_empty_in_concatenation():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field", "baz_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=None,
-                    baz_field=str(ast["baz_field"]),
+                    str(ast["foo_field"]),
+                    None,
+                    str(ast["baz_field"]),
                 )
 
             foo_field: str
@@ -464,7 +613,7 @@ def test_empty_in_concatenation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -512,16 +661,18 @@ def test_sequence_in_concatenation():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field", "baz_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=[str(ast_bar_field_item) for ast_bar_field_item in ast["bar_field"]],
-                    baz_field=str(ast["baz_field"]),
+                    str(ast["foo_field"]),
+                    tuple(str(ast_bar_field_item) for ast_bar_field_item in ast["bar_field"]),
+                    str(ast["baz_field"]),
                 )
 
             foo_field: str
-            bar_field: typing.List[str]
+            bar_field: typing.Tuple[str, ...]
             baz_field: str
 
 
@@ -532,14 +683,14 @@ def test_sequence_in_concatenation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
-    assert g.parse("foo baz", semantics=semantics) == Main("foo", [], "baz")
-    assert g.parse("foo bar baz", semantics=semantics) == Main("foo", ["bar"], "baz")
+    assert g.parse("foo baz", semantics=semantics) == Main("foo", (), "baz")
+    assert g.parse("foo bar baz", semantics=semantics) == Main("foo", ("bar",), "baz")
     assert g.parse("foo bar bar baz", semantics=semantics) == Main(
-        "foo", ["bar", "bar"], "baz"
+        "foo", ("bar", "bar"), "baz"
     )
     with pytest.raises(exceptions.FailedToken):
         g.parse("foo", semantics=semantics)
@@ -550,7 +701,7 @@ def test_sequence_in_concatenation():
 def test_simple_alternation():
     """An alternation of only empty subtrees, meaning it can be serialialized as
     an Enum rather than an ADT."""
-    grammar = gll_grammar.Grammar(
+    semantics_grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
                 [
@@ -560,7 +711,7 @@ def test_simple_alternation():
             )
         }
     )
-    sc = generate_semantics_code(grammar)
+    sc = generate_semantics_code(semantics_grammar)
     grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
@@ -606,7 +757,7 @@ def test_simple_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(semantics_grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -618,7 +769,7 @@ def test_simple_alternation():
 
 def test_maybe_in_alternation():
     """An alternation with Maybe as one of the variants."""
-    grammar = gll_grammar.Grammar(
+    semantics_grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
                 [
@@ -630,7 +781,7 @@ def test_maybe_in_alternation():
             )
         }
     )
-    sc = generate_semantics_code(grammar)
+    sc = generate_semantics_code(semantics_grammar)
     grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
@@ -659,18 +810,13 @@ def test_maybe_in_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar"}
+            __slots__ = ()
 
-            @dataclasses.dataclass
-            class Foo:
-                @classmethod
-                def from_ast(cls, ast):
-                    return cls()
+            class Foo(rust_parser.gll.semantics.EmptyLeaf):
+                __slots__ = ()
 
-            @dataclasses.dataclass
-            class BarInner:
-                @classmethod
-                def from_ast(cls, ast):
-                    return cls()
+            class BarInner(rust_parser.gll.semantics.EmptyLeaf):
+                __slots__ = ()
 
             Bar = rust_parser.gll.semantics.Maybe[BarInner]
 
@@ -682,7 +828,7 @@ def test_maybe_in_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(semantics_grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     print(Main.Bar.mro())
@@ -694,7 +840,7 @@ def test_maybe_in_alternation():
 
 def test_mixed_alternation():
     """An alternation of both empty and non-empty subtrees."""
-    grammar = gll_grammar.Grammar(
+    semantics_grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
                 [
@@ -716,7 +862,7 @@ def test_mixed_alternation():
             )
         }
     )
-    sc = generate_semantics_code(grammar)
+    sc = generate_semantics_code(semantics_grammar)
     grammar = gll_grammar.Grammar(
         rules={
             "Main": gll_grammar.Alternation(
@@ -755,20 +901,20 @@ def test_mixed_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar"}
+            __slots__ = ()
 
-            @dataclasses.dataclass
-            class Foo:
-                @classmethod
-                def from_ast(cls, ast):
-                    return cls()
+            class Foo(rust_parser.gll.semantics.EmptyLeaf):
+                __slots__ = ()
 
             @dataclasses.dataclass
             class Bar:
+                __slots__ = ("bar1", "bar2")
+
                 @classmethod
                 def from_ast(cls, ast) -> Bar:
                     return cls(
-                        bar1=str(ast["bar1"]),
-                        bar2=str(ast["bar2"]),
+                        str(ast["bar1"]),
+                        str(ast["bar2"]),
                     )
 
                 bar1: str
@@ -782,12 +928,13 @@ def test_mixed_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(semantics_grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
     assert g.parse("foo", semantics=semantics) == Main.Foo()
     assert g.parse("bar1 bar2", semantics=semantics) == Main.Bar("bar1", "bar2")
+    assert not hasattr(g.parse("bar1 bar2", semantics=semantics), "__dict__")
     with pytest.raises(exceptions.FailedParse):
         g.parse("baz", semantics=semantics)
 
@@ -831,11 +978,13 @@ def test_alternation_with_anonymous_variant_in_concatenation():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=(lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict(Bar1=(lambda: str(ast["Bar1"])), Variant1=(lambda: str(ast["Variant1"]))))(),
+                    str(ast["foo_field"]),
+                    (lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict(Bar1=(lambda: str(ast["Bar1"])), Variant1=(lambda: str(ast["Variant1"]))))(),
                 )
 
             foo_field: str
@@ -849,7 +998,7 @@ def test_alternation_with_anonymous_variant_in_concatenation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -903,12 +1052,14 @@ def test_alternation_in_concatenation():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field", "baz_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=(lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict(Bar1=(lambda: str(ast["Bar1"])), Bar2=(lambda: str(ast["Bar2"]))))(),
-                    baz_field=str(ast["baz_field"]),
+                    str(ast["foo_field"]),
+                    (lambda constructors: constructors.get((list(set(constructors) & set(ast)) or [None])[0], lambda: None))(dict(Bar1=(lambda: str(ast["Bar1"])), Bar2=(lambda: str(ast["Bar2"]))))(),
+                    str(ast["baz_field"]),
                 )
 
             foo_field: str
@@ -923,7 +1074,7 @@ def test_alternation_in_concatenation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -975,12 +1126,14 @@ def test_rule_reference():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field", "baz_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=ast["bar_field"],
-                    baz_field=str(ast["baz_field"]),
+                    str(ast["foo_field"]),
+                    ast["bar_field"],
+                    str(ast["baz_field"]),
                 )
 
             foo_field: str
@@ -990,11 +1143,13 @@ def test_rule_reference():
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1011,7 +1166,7 @@ def test_rule_reference():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
@@ -1064,33 +1219,37 @@ def test_root_repeated_rule_reference():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar_"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
             @dataclasses.dataclass
             class Bar_Inner:
+                __slots__ = ("inner",)
                 inner: Bar
 
                 @classmethod
                 def from_ast(cls, ast) -> Bar_Inner:
                     return cls(inner=ast)
 
-            class Bar_(typing.List[Bar_Inner]):
+            class Bar_(typing.Tuple[Bar_Inner, ...]):
+                __slots__ = ()
+
                 @classmethod
                 def from_ast(cls, ast) -> Bar_:
-                    return cls(list(map(cls.Bar_Inner.from_ast, ast)))
+                    return cls(map(cls.Bar_Inner.from_ast, ast))
 
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1107,7 +1266,7 @@ def test_root_repeated_rule_reference():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
@@ -1164,33 +1323,37 @@ def test_root_repeated_rule_reference_with_separator():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar_"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
             @dataclasses.dataclass
             class Bar_Inner:
+                __slots__ = ("inner",)
                 inner: Bar
 
                 @classmethod
                 def from_ast(cls, ast) -> Bar_Inner:
                     return cls(inner=ast)
 
-            class Bar_(typing.List[Bar_Inner]):
+            class Bar_(typing.Tuple[Bar_Inner, ...]):
+                __slots__ = ()
+
                 @classmethod
                 def from_ast(cls, ast) -> Bar_:
-                    return cls(list(map(cls.Bar_Inner.from_ast, ast[0::2])))
+                    return cls(map(cls.Bar_Inner.from_ast, ast[0::2]))
 
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1207,7 +1370,7 @@ def test_root_repeated_rule_reference_with_separator():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
@@ -1267,21 +1430,23 @@ def test_root_repeated_rule_reference_with_separator_trailing():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar_"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
             @dataclasses.dataclass
             class Bar_Inner:
+                __slots__ = ("inner",)
                 inner: Bar
 
                 @classmethod
                 def from_ast(cls, ast) -> Bar_Inner:
                     return cls(inner=ast)
 
-            class Bar_(typing.List[Bar_Inner]):
+            class Bar_(typing.Tuple[Bar_Inner, ...]):
+                __slots__ = ()
+
                 @classmethod
                 def from_ast(cls, ast) -> Bar_:
                     return cls(map(cls.Bar_Inner.from_ast, rust_parser.gll.semantics.flatten_repeated_list_with_trailing('::', ast)))
@@ -1289,11 +1454,13 @@ def test_root_repeated_rule_reference_with_separator_trailing():
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1310,7 +1477,7 @@ def test_root_repeated_rule_reference_with_separator_trailing():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
@@ -1371,24 +1538,28 @@ def test_nested_repeated_rule_reference():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=[ast_bar_field_item for ast_bar_field_item in ast["bar_field"]],
+                    str(ast["foo_field"]),
+                    tuple(ast_bar_field_item for ast_bar_field_item in ast["bar_field"]),
                 )
 
             foo_field: str
-            bar_field: typing.List[Bar]
+            bar_field: typing.Tuple[Bar, ...]
 
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1405,17 +1576,17 @@ def test_nested_repeated_rule_reference():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
 
-    assert g.parse("foo", semantics=semantics) == Main("foo", [])
+    assert g.parse("foo", semantics=semantics) == Main("foo", ())
     assert g.parse("foo bar1 bar2", semantics=semantics) == Main(
-        "foo", [Bar("bar1", "bar2")]
+        "foo", (Bar("bar1", "bar2"),)
     )
     assert g.parse("foo bar1 bar2 bar1 bar2", semantics=semantics) == Main(
-        "foo", [Bar("bar1", "bar2"), Bar("bar1", "bar2")]
+        "foo", (Bar("bar1", "bar2"), Bar("bar1", "bar2"))
     )
 
 
@@ -1463,24 +1634,28 @@ def test_nested_repeated_rule_reference_with_separator():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo_field", "bar_field")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo_field=str(ast["foo_field"]),
-                    bar_field=[ast_bar_field_item for ast_bar_field_item in ast["bar_field"][0::2]],
+                    str(ast["foo_field"]),
+                    tuple(ast_bar_field_item for ast_bar_field_item in ast["bar_field"][0::2]),
                 )
 
             foo_field: str
-            bar_field: typing.List[Bar]
+            bar_field: typing.Tuple[Bar, ...]
 
 
         @dataclasses.dataclass
         class Bar:
+            __slots__ = ("bar1_field", "bar2_field")
+
             @classmethod
             def from_ast(cls, ast) -> Bar:
                 return cls(
-                    bar1_field=str(ast["bar1_field"]),
-                    bar2_field=str(ast["bar2_field"]),
+                    str(ast["bar1_field"]),
+                    str(ast["bar2_field"]),
                 )
 
             bar1_field: str
@@ -1497,17 +1672,17 @@ def test_nested_repeated_rule_reference_with_separator():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     Bar = namespace["Bar"]
 
-    assert g.parse("foo", semantics=semantics) == Main("foo", [])
+    assert g.parse("foo", semantics=semantics) == Main("foo", ())
     assert g.parse("foo bar1 bar2", semantics=semantics) == Main(
-        "foo", [Bar("bar1", "bar2")]
+        "foo", (Bar("bar1", "bar2"),)
     )
     assert g.parse("foo bar1 bar2 :: bar1 bar2", semantics=semantics) == Main(
-        "foo", [Bar("bar1", "bar2"), Bar("bar1", "bar2")]
+        "foo", (Bar("bar1", "bar2"), Bar("bar1", "bar2"))
     )
 
 
@@ -1544,16 +1719,13 @@ def test_option_in_root_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
-            class BarInner(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> BarInner:
-                    return cls(ast)
+            class BarInner(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
             Bar = rust_parser.gll.semantics.Maybe[BarInner]
 
@@ -1565,7 +1737,7 @@ def test_option_in_root_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -1603,17 +1775,13 @@ def test_empty_in_root_alternation():
         @typing.sealed
         class Main(metaclass=rust_parser.gll.semantics.ADT):
             _variants = {"Foo": "Foo", "Bar": "Bar"}
+            __slots__ = ()
 
-            class Foo(str):
-                @classmethod
-                def from_ast(cls, ast: str) -> Foo:
-                    return cls(ast)
+            class Foo(rust_parser.gll.semantics.StrLeaf):
+                __slots__ = ()
 
-            @dataclasses.dataclass
-            class Bar:
-                @classmethod
-                def from_ast(cls, ast):
-                    return cls()
+            class Bar(rust_parser.gll.semantics.EmptyLeaf):
+                __slots__ = ()
 
 
         class Semantics:
@@ -1623,7 +1791,7 @@ def test_empty_in_root_alternation():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
 
@@ -1667,11 +1835,13 @@ def test_reference_ident():
 
         @dataclasses.dataclass
         class Main:
+            __slots__ = ("foo", "bar")
+
             @classmethod
             def from_ast(cls, ast) -> Main:
                 return cls(
-                    foo=ast["foo"],
-                    bar=ast["bar"],
+                    ast["foo"],
+                    ast["bar"],
                 )
 
             foo: rust_parser.gll.builtin_rules.IDENT
@@ -1680,11 +1850,13 @@ def test_reference_ident():
 
         @dataclasses.dataclass
         class SBar:
+            __slots__ = ("bar1", "bar2")
+
             @classmethod
             def from_ast(cls, ast) -> SBar:
                 return cls(
-                    bar1=str(ast["bar1"]),
-                    bar2=str(ast["bar2"]),
+                    str(ast["bar1"]),
+                    str(ast["bar2"]),
                 )
 
             bar1: str
@@ -1701,7 +1873,7 @@ def test_reference_ident():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar, use_builtin_rules=True), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     SBar = namespace["SBar"]
@@ -1749,25 +1921,30 @@ def test_labeled_repeated():
 
         @dataclasses.dataclass
         class MainInner:
+            __slots__ = ("inner",)
             inner: Item
 
             @classmethod
             def from_ast(cls, ast) -> MainInner:
                 return cls(inner=ast)
 
-        class Main(typing.List[MainInner]):
+        class Main(typing.Tuple[MainInner, ...]):
+            __slots__ = ()
+
             @classmethod
             def from_ast(cls, ast) -> Main:
-                return cls(list(map(MainInner.from_ast, ast["items"][0::2])))
+                return cls(map(MainInner.from_ast, ast["items"][0::2]))
 
 
         @dataclasses.dataclass
         class Item:
+            __slots__ = ("foo", "bar")
+
             @classmethod
             def from_ast(cls, ast) -> Item:
                 return cls(
-                    foo=str(ast["foo"]),
-                    bar=str(ast["bar"]),
+                    str(ast["foo"]),
+                    str(ast["bar"]),
                 )
 
             foo: str
@@ -1784,7 +1961,7 @@ def test_labeled_repeated():
     )
 
     namespace = {}
-    exec(sc, namespace)
+    exec(compile_semantics(grammar, use_builtin_rules=True), namespace)
     semantics = namespace["Semantics"]()
     Main = namespace["Main"]
     MainInner = namespace["MainInner"]
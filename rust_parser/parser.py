@@ -15,13 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
+import glob
+import hashlib
 import os.path
-import importlib.util
+import pickle
 import pkg_resources
-import secrets
 import sys
-import tempfile
-import types
+import threading
 import typing
 
 import tatsu
@@ -31,7 +31,13 @@ import tatsu.grammars
 from .gll.tokens import tokenize_gll
 from .gll.grammar import parse_gll
 from .gll.generate import generate_tatsu_grammar
-from .gll.semantics import generate_semantics_code
+from .gll.semantics import (
+    generate_semantics_code,
+    import_semantics_code,
+    is_private_dir,
+    write_file_atomically,
+    USER_CACHE_DIR,
+)
 from .gll.simplification import simplify_grammar
 from .gll.builtin_rules import BUILTIN_RULES
 
@@ -39,16 +45,28 @@ from .gll.builtin_rules import BUILTIN_RULES
 GRAMMAR_PATH = "wg-grammar/grammar/"
 
 
-# TODO: that's ugly, we shouldn't need a tempfile for that, and especially not let it
-# live for as long as the process, but it's the only way I could find to make pytest
-# find the code
-ast_dir = tempfile.TemporaryDirectory("rust_parser_asts")
-# class ast_dir:
-#    name = "asts/"
+PARSER_CACHE_DIR = os.path.join(USER_CACHE_DIR, "parsers")
+"""Default directory where Parser caches the grammars it generated."""
 
 
 class Parser:
-    def __init__(self, start_rules: typing.Dict[str, str]):
+    def __init__(
+        self,
+        start_rules: typing.Dict[str, str],
+        memoize_rules: typing.Optional[typing.Set[str]] = None,
+        cache_dir: typing.Optional[str] = None,
+    ):
+        """Builds a parser from the GLL grammar.
+
+        'memoize_rules' is passed to generate_tatsu_grammar, to memoize only
+        some rules.
+
+        Generating the Tatsu grammar and semantics is expensive, so they are
+        cached in 'cache_dir' (which defaults to PARSER_CACHE_DIR), keyed on
+        everything they are generated from; and the semantics are imported from
+        its 'semantics' subdirectory (or SEMANTICS_CACHE_DIR by default).
+        The cache is not used if it can't be written, or could be written by
+        other users."""
 
         code = "\n\n".join(
             pkg_resources.resource_string(
@@ -58,46 +76,145 @@ class Parser:
         )
         assert code
 
-        start_rules = [
-            tatsu.grammars.Rule(
-                ast=None,
-                params=None,
-                kwparams=None,
-                name=start_rule_name,
-                exp=tatsu.grammars.Sequence(
-                    ast=tatsu.ast.AST(
-                        sequence=[
-                            tatsu.grammars.RuleRef(start_rule_target),
-                            tatsu.grammars.EOF(),
-                        ]
-                    )
-                ),
-            )
-            for (start_rule_name, start_rule_target) in start_rules.items()
-        ]
-
-        tokens = tokenize_gll(code)
-        gll_grammar = parse_gll(tokens)
-        self.tatsu_grammar = generate_tatsu_grammar(
-            gll_grammar, extra_rules=BUILTIN_RULES + start_rules
+        if cache_dir is None:
+            cache_dir = PARSER_CACHE_DIR
+            semantics_cache_dir = None  # import_semantics_code's default
+        else:
+            semantics_cache_dir = os.path.join(cache_dir, "semantics")
+        cache_filename = os.path.join(
+            cache_dir, f"parser_{_cache_key(code, start_rules, memoize_rules)}.pickle"
         )
+        cached = _load_cache(cache_filename)
+        if cached is None:
+            cached = _generate(code, start_rules, memoize_rules)
+            _write_cache(cache_filename, cached)
+        (self.tatsu_grammar, semantics_code) = cached
 
-        # TODO: that's ugly, we shouldn't need a tempfile for that, but it's
-        # the only way I could find to make pytest find the code
-        semantics_code = generate_semantics_code(
-            simplify_grammar(gll_grammar), use_builtin_rules=True
-        )
-        module_name = "ast_" + secrets.token_hex(10)
-        module_fullname = "rust_parser.asts." + module_name
-        filename = os.path.join(ast_dir.name, module_name + ".py")
-        with open(filename, "wt") as fd:
-            fd.write(semantics_code)
-        spec = importlib.util.spec_from_file_location(module_fullname, filename)
-        self.ast = importlib.util.module_from_spec(spec)
-        sys.modules[module_fullname] = self.ast  # needed by dataclasses when executing
-        spec.loader.exec_module(self.ast)
+        self.ast = import_semantics_code(semantics_code, semantics_cache_dir)
+        self._semantics = self.ast.Semantics()  # stateless
+        self._local = threading.local()
 
     def parse(self, s, start_rule_name):
         return self.tatsu_grammar.parse(
-            s, semantics=self.ast.Semantics(), rule_name=start_rule_name
+            s,
+            semantics=self._semantics,
+            rule_name=start_rule_name,
+            context=self._context(),
+        )
+
+    def _context(self) -> tatsu.grammars.ModelContext:
+        """Returns a Tatsu parse context for this thread.
+
+        tatsu.grammars.Grammar.parse creates a new one by default, which
+        builds a table of all the rules of the grammar for each call. Contexts
+        are reset at the beginning of each parse, so they can be reused by
+        successive calls in the same thread."""
+        try:
+            return self._local.context
+        except AttributeError:
+            pass
+        context = tatsu.grammars.ModelContext(
+            self.tatsu_grammar.rules, keywords=self.tatsu_grammar.keywords
+        )
+        self._local.context = context
+        return context
+
+
+def _generate(
+    code: str,
+    start_rules: typing.Dict[str, str],
+    memoize_rules: typing.Optional[typing.Set[str]],
+) -> typing.Tuple[tatsu.grammars.Grammar, str]:
+    """Returns the Tatsu grammar and the semantics code generated from
+    the GLL grammar."""
+    start_rules = [
+        tatsu.grammars.Rule(
+            ast=None,
+            params=None,
+            kwparams=None,
+            name=start_rule_name,
+            exp=tatsu.grammars.Sequence(
+                ast=tatsu.ast.AST(
+                    sequence=[
+                        tatsu.grammars.RuleRef(start_rule_target),
+                        tatsu.grammars.EOF(),
+                    ]
+                )
+            ),
         )
+        for (start_rule_name, start_rule_target) in start_rules.items()
+    ]
+
+    tokens = tokenize_gll(code)
+    gll_grammar = parse_gll(tokens)
+    tatsu_grammar = generate_tatsu_grammar(
+        gll_grammar,
+        extra_rules=BUILTIN_RULES + start_rules,
+        memoize_rules=memoize_rules,
+    )
+
+    semantics_code = generate_semantics_code(
+        simplify_grammar(gll_grammar), use_builtin_rules=True
+    )
+
+    return (tatsu_grammar, semantics_code)
+
+
+def _load_cache(
+    cache_filename: str,
+) -> typing.Optional[typing.Tuple[tatsu.grammars.Grammar, str]]:
+    """Returns the Tatsu grammar and semantics code cached in the file, or None
+    if it is missing, invalid, or could have been written by other users
+    (unpickling runs arbitrary code)."""
+    if not is_private_dir(os.path.dirname(cache_filename)):
+        return None
+    try:
+        with open(cache_filename, "rb") as fd:
+            (tatsu_grammar, semantics_code) = pickle.load(fd)
+    except (
+        OSError,
+        EOFError,
+        pickle.UnpicklingError,
+        # The pickle refers to objects which do not exist (anymore), or
+        # is not a pair
+        AttributeError,
+        ImportError,
+        TypeError,
+        ValueError,
+    ):
+        return None
+    return (tatsu_grammar, semantics_code)
+
+
+def _write_cache(
+    cache_filename: str, cached: typing.Tuple[tatsu.grammars.Grammar, str]
+) -> None:
+    """Writes the Tatsu grammar and semantics code to the file, unless its
+    directory can't be written or is not private."""
+    cache_dir = os.path.dirname(cache_filename)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if is_private_dir(cache_dir):
+            write_file_atomically(cache_filename, pickle.dumps(cached))
+    except OSError:
+        pass
+
+
+def _cache_key(
+    code: str,
+    start_rules: typing.Dict[str, str],
+    memoize_rules: typing.Optional[typing.Set[str]],
+) -> str:
+    """Returns a digest of everything the output of _generate depends on."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(sys.version_info).encode())
+    h.update(tatsu.__version__.encode())
+    h.update(repr(sorted(start_rules.items())).encode())
+    h.update(repr(memoize_rules and sorted(memoize_rules)).encode())
+    # The generators themselves, including _generate in this file
+    gll_dir = os.path.join(os.path.dirname(__file__), "gll")
+    for filename in [__file__, *sorted(glob.glob(os.path.join(gll_dir, "*.py")))]:
+        with open(filename, "rb") as fd:
+            h.update(fd.read())
+    h.update(code.encode())
+    return h.hexdigest()
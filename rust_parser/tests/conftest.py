@@ -15,14 +15,34 @@
 # You should have received a copy of the GNU General Public License
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
+import functools
+
 import pytest
 
 from ..parser import Parser
 
 
+class _MemoizingParser:
+    """Wraps a Parser to memoize the results of parse(), so tests can parse the
+    same snippets without paying for it again. Tests must not mutate the ASTs
+    they get."""
+
+    def __init__(self, parser: Parser):
+        self.ast = parser.ast
+        self.parse = functools.lru_cache(maxsize=None)(parser.parse)
+
+
+# Building the parser (and generating its semantics) is much more expensive than
+# parsing the short snippets of the tests, so it is shared by all of them.
+# With pytest-xdist, each worker builds its own (from the on-disk cache, which
+# is safe to fill concurrently), and memoizes its own parse results.
+# Parser.parse keeps no state between calls (its Tatsu context is reset
+# at the beginning of each call).
 @pytest.fixture(scope="session")
 def parser():
-    return Parser(start_rules={"ExprMain": "Expr", "ModuleMain": "ModuleContents"})
+    return _MemoizingParser(
+        Parser(start_rules={"ExprMain": "Expr", "ModuleMain": "ModuleContents"})
+    )
 
 
 @pytest.fixture(scope="session")
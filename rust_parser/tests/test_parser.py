@@ -15,178 +15,259 @@
 # You should have received a copy of the GNU General Public License
 # along with python-rust-parser.  If not, see <https://www.gnu.org/licenses/>.
 
+import functools
+
+import pkg_resources
+import pytest
+
+from .. import parser as parser_module
 from ..gll import builtin_rules
 
 
-def test_parse_addition(parser, ast):
-    assert parser.parse("1 + 2", start_rule_name="ExprMain") == ast.Expr(
-        attrs=[],
+@functools.lru_cache(maxsize=None)
+def simple_type(ast, name):
+    """Returns the AST of a type which is only a name, eg. 'u64'.
+
+    Takes the ast module as argument, as it is only available from fixtures."""
+    return ast.Type.Path_(
+        inner=ast.QPath.Unqualified(
+            inner=ast.Path(
+                global_=False,
+                path=(
+                    ast.RelativePathInner(
+                        inner=ast.PathSegment(
+                            ident=builtin_rules.IDENT(name), field_1=None
+                        )
+                    ),
+                ),
+            )
+        )
+    )
+
+
+@pytest.fixture(scope="module")
+def expected_addition_ast(ast):
+    return ast.Expr(
+        attrs=(),
         kind=ast.ExprKind.Binary(
             left=ast.Expr(
-                attrs=[],
-                kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL(literal="1")),
+                attrs=(),
+                kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL("1")),
             ),
             op=ast.BinaryOp.ADD,
             right=ast.Expr(
-                attrs=[],
-                kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL(literal="2")),
+                attrs=(),
+                kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL("2")),
             ),
         ),
     )
 
 
-def test_parse_const_declaration(parser, ast):
-    assert parser.parse(
-        'const foo: bar = "baz";', start_rule_name="ModuleMain"
-    ) == ast.ModuleContents(
-        attrs=[],
-        items=[
+def test_parse_addition(parser, expected_addition_ast):
+    assert parser.parse("1 + 2", start_rule_name="ExprMain") == expected_addition_ast
+
+
+def test_parse_long_addition(parser, ast):
+    """Guards against left-recursive rules (eg. binary operators) taking
+    exponential time."""
+
+    def operands(expr):
+        if isinstance(expr.kind, ast.ExprKind.Binary):
+            assert expr.kind.op == ast.BinaryOp.ADD
+            return operands(expr.kind.left) + operands(expr.kind.right)
+        else:
+            return [expr.kind.inner.literal]
+
+    # Not too many, as Tatsu recurses (in Python) for each operator
+    numbers = [str(i) for i in range(16)]
+    expr = parser.parse(" + ".join(numbers), start_rule_name="ExprMain")
+
+    assert operands(expr) == numbers
+
+
+@pytest.fixture(scope="module")
+def expected_const_ast(ast):
+    return ast.ModuleContents(
+        attrs=(),
+        items=(
             ast.Item(
-                attrs=[],
+                attrs=(),
                 vis=None,
                 kind=ast.ItemKind.Const(
-                    name=builtin_rules.IDENT(ident="foo"),
-                    ty=ast.Type.Path_(
-                        inner=ast.QPath.Unqualified(
-                            inner=ast.Path(
-                                global_=False,
-                                path=[
-                                    ast.RelativePathInner(
-                                        inner=ast.PathSegment(
-                                            ident=builtin_rules.IDENT(ident="bar"),
-                                            field_1=None,
-                                        )
-                                    )
-                                ],
-                            )
-                        )
-                    ),
+                    name=builtin_rules.IDENT("foo"),
+                    ty=simple_type(ast, "bar"),
                     value=ast.Expr(
-                        attrs=[],
-                        kind=ast.ExprKind.Literal(
-                            inner=builtin_rules.LITERAL(literal='"baz"')
-                        ),
+                        attrs=(),
+                        kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL('"baz"')),
                     ),
                 ),
-            )
-        ],
+            ),
+        ),
     )
 
 
-def test_parse_fn_declaration(parser, ast):
+def test_parse_const_declaration(parser, expected_const_ast):
+    assert (
+        parser.parse('const foo: bar = "baz";', start_rule_name="ModuleMain")
+        == expected_const_ast
+    )
+
+
+@pytest.fixture(scope="module")
+def expected_fn_foo_ast(ast):
+    """Returns a function building the expected AST of 'fn foo() { 42 ... }'.
+
+    Subtrees which are the same in all cases are built once, and shared."""
+    header = ast.FnHeader(constness=False, unsafety=False, asyncness=False, abi=None)
+    stmt_42 = ast.Stmt.Expr_(
+        inner=ast.Expr(
+            attrs=(),
+            kind=ast.ExprKind.Literal(inner=builtin_rules.LITERAL("42")),
+        )
+    )
+
     def expected_ast(extra_stmts, ret_ty):
-        return [
+        return (
             ast.Item(
-                attrs=[],
+                attrs=(),
                 vis=None,
                 kind=ast.ItemKind.Fn(
-                    header=ast.FnHeader(
-                        constness=False, unsafety=False, asyncness=False, abi=None
-                    ),
+                    header=header,
                     decl=ast.FnDecl(
-                        name=builtin_rules.IDENT(ident="foo"),
+                        name=builtin_rules.IDENT("foo"),
                         generics=None,
                         args=None,
                         ret_ty=ret_ty,
                         where_clause=None,
                     ),
-                    body=ast.Block(
-                        attrs=[],
-                        stmts=[
-                            ast.Stmt.Expr_(
-                                inner=ast.Expr(
-                                    attrs=[],
-                                    kind=ast.ExprKind.Literal(
-                                        inner=builtin_rules.LITERAL(literal="42")
-                                    ),
-                                )
-                            ),
-                            *extra_stmts,
-                        ],
-                    ),
+                    body=ast.Block(attrs=(), stmts=(stmt_42, *extra_stmts)),
                 ),
-            )
-        ]
-
-    assert parser.parse(
-        "fn foo() { 42 }", start_rule_name="ModuleMain"
-    ) == ast.ModuleContents(attrs=[], items=expected_ast(extra_stmts=[], ret_ty=None))
-
-    assert parser.parse(
-        "fn foo() -> u64 { 42 }", start_rule_name="ModuleMain"
-    ) == ast.ModuleContents(
-        attrs=[],
-        items=expected_ast(
-            extra_stmts=[],
-            ret_ty=ast.Type.Path_(
-                inner=ast.QPath.Unqualified(
-                    inner=ast.Path(
-                        global_=False,
-                        path=[
-                            ast.RelativePathInner(
-                                inner=ast.PathSegment(
-                                    ident=builtin_rules.IDENT(ident="u64"), field_1=None
-                                )
-                            )
-                        ],
-                    )
-                )
             ),
-        ),
-    )
+        )
+
+    return expected_ast
 
-    assert parser.parse(
-        "fn foo() { 42; }", start_rule_name="ModuleMain"
-    ) == ast.ModuleContents(
-        attrs=[], items=expected_ast(extra_stmts=[ast.Stmt.Semi()], ret_ty=None)
+
+@pytest.mark.parametrize(
+    "source,extra_stmts,ret_ty",
+    [
+        ("fn foo() { 42 }", lambda ast: (), lambda ast: None),
+        (
+            "fn foo() -> u64 { 42 }",
+            lambda ast: (),
+            lambda ast: simple_type(ast, "u64"),
+        ),
+        ("fn foo() { 42; }", lambda ast: (ast.Stmt.Semi(),), lambda ast: None),
+    ],
+    ids=["no_ret_ty", "ret_ty", "semi"],
+)
+def test_parse_fn_declaration(
+    parser, ast, expected_fn_foo_ast, source, extra_stmts, ret_ty
+):
+    # extra_stmts and ret_ty are functions, as the ast module does not exist
+    # before the parser fixture is built.
+    assert parser.parse(source, start_rule_name="ModuleMain") == ast.ModuleContents(
+        attrs=(),
+        items=expected_fn_foo_ast(extra_stmts=extra_stmts(ast), ret_ty=ret_ty(ast)),
     )
 
 
-def test_parse_struct(parser, ast):
-    expected_ast = ast.ModuleContents(
-        attrs=[],
-        items=[
+@pytest.fixture(scope="module")
+def expected_struct_ast(ast):
+    return ast.ModuleContents(
+        attrs=(),
+        items=(
             ast.Item(
-                attrs=[],
+                attrs=(),
                 vis=None,
                 kind=ast.ItemKind.Struct(
-                    name=builtin_rules.IDENT(ident="Foo"),
+                    name=builtin_rules.IDENT("Foo"),
                     generics=None,
                     body=ast.StructBody.Record(
                         where_clause=None,
-                        fields=[
+                        fields=(
                             ast.RecordField(
-                                attrs=[],
+                                attrs=(),
                                 vis=None,
-                                name=builtin_rules.IDENT(ident="bar"),
-                                ty=ast.Type.Path_(
-                                    inner=ast.QPath.Unqualified(
-                                        inner=ast.Path(
-                                            global_=False,
-                                            path=[
-                                                ast.RelativePathInner(
-                                                    inner=ast.PathSegment(
-                                                        ident=builtin_rules.IDENT(
-                                                            ident="Baz"
-                                                        ),
-                                                        field_1=None,
-                                                    )
-                                                )
-                                            ],
-                                        )
-                                    )
-                                ),
-                            )
-                        ],
+                                name=builtin_rules.IDENT("bar"),
+                                ty=simple_type(ast, "Baz"),
+                            ),
+                        ),
                     ),
                 ),
-            )
-        ],
+            ),
+        ),
     )
 
-    assert parser.parse(
-        "struct Foo { bar: Baz }", start_rule_name="ModuleMain"
-    ) == expected_ast
-    assert parser.parse(
-        "struct Foo { bar: Baz, }", start_rule_name="ModuleMain"
-    ) == expected_ast
+
+@pytest.mark.parametrize(
+    "source",
+    ["struct Foo { bar: Baz }", "struct Foo { bar: Baz, }"],
+    ids=["no_trailing_comma", "trailing_comma"],
+)
+def test_parse_struct(parser, expected_struct_ast, source):
+    assert parser.parse(source, start_rule_name="ModuleMain") == expected_struct_ast
+
+
+@pytest.fixture
+def toy_grammar(monkeypatch):
+    """Replaces the Rust grammar with a small one, and counts how many times
+    a parser is generated from it."""
+    code = """
+        ToyMain = kind:ToyKind;
+        ToyKind = | Add:{ left:LITERAL "+" right:LITERAL } | Literal:LITERAL;
+    """
+    monkeypatch.setattr(pkg_resources, "resource_listdir", lambda *_: ["toy.lyg"])
+    monkeypatch.setattr(pkg_resources, "resource_string", lambda *_: code.encode())
+
+    calls = []
+
+    def _generate(*args):
+        calls.append(args)
+        return generate(*args)
+
+    generate = parser_module._generate
+    monkeypatch.setattr(parser_module, "_generate", _generate)
+    return calls
+
+
+def test_parser_cache(tmp_path, toy_grammar):
+    def parse():
+        parser = parser_module.Parser(
+            start_rules={"Start": "ToyMain"}, cache_dir=str(tmp_path)
+        )
+        ast = parser.ast
+        assert parser.parse("1 + 2", start_rule_name="Start") == ast.ToyMain(
+            inner=ast.ToyKind.Add(
+                left=builtin_rules.LITERAL("1"), right=builtin_rules.LITERAL("2")
+            )
+        )
+
+    parse()  # miss
+    assert len(toy_grammar) == 1
+    (cache_file,) = tmp_path.glob("parser_*.pickle")
+    assert list(tmp_path.glob("semantics/sem_*.py"))
+
+    parse()  # hit
+    assert len(toy_grammar) == 1
+
+    cache_file.write_bytes(b"garbage")
+    parse()  # corrupt
+    assert len(toy_grammar) == 2
+
+    parse()  # rewritten
+    assert len(toy_grammar) == 2
+
+
+def test_parser_cache_unusable(tmp_path, toy_grammar):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+
+    for _ in range(2):
+        parser = parser_module.Parser(
+            start_rules={"Start": "ToyMain"}, cache_dir=str(cache_dir)
+        )
+        assert parser.parse("1", start_rule_name="Start")
+    assert len(toy_grammar) == 2
+    assert not list(cache_dir.glob("**/*.*"))